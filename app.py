@@ -4,27 +4,28 @@ from st_bridge import bridge
 import time
 import uuid
 from datetime import datetime
-from db_handler import MongoDBHandler
-from text_analyzer import TextMoodAnalyzer
-from jamendo_api import JamendoAPI
-from recommendation_system import MusicRecommendationSystem
-from user_auth import UserAuth
-from utils import nltk_setup, call_gemini_emotion_api, GEMINI_API_URL, GEMINI_API_KEY
-
-nltk_setup()  # Ensure NLTK data is downloaded once
+from services import get_services
+from password_hasher import HasherBusy, HasherTimeout
+from session_manager import SessionUnavailable
+from utils import GEMINI_API_URL, GEMINI_API_KEY
 
 class EmotionMusicApp:
     def __init__(self):
         self.setup_session_state()
-        self.db_handler = MongoDBHandler()
-        self.text_analyzer = TextMoodAnalyzer()
-        self.jamendo_api = JamendoAPI()
-        self.rec_system = MusicRecommendationSystem(self.db_handler, self.jamendo_api)
-        self.user_auth = UserAuth(self.db_handler)
+        services = get_services()
+        self.db_handler = services.db_handler
+        self.text_analyzer = services.text_analyzer
+        self.jamendo_api = services.jamendo_api
+        self.rec_system = services.rec_system
+        self.user_auth = services.user_auth
+        self.emotion_detector = services.emotion_detector
+        self.session_manager = services.session_manager
 
     def setup_session_state(self):
         if 'user_id' not in st.session_state:
             st.session_state.user_id = None
+        if 'session_token' not in st.session_state:
+            st.session_state.session_token = None
         if 'current_mood' not in st.session_state:
             st.session_state.current_mood = None
         if 'emotion_data' not in st.session_state:
@@ -472,8 +473,44 @@ window.addEventListener('load', async () => {
                     st.error("❌ Please login first")
         st.divider()
 
+    def current_profile(self):
+        return self.session_manager.get_profile(st.session_state.session_token)
+
+    def start_session(self, user):
+        # Logging in stamps lastLogin, so the user's other sessions reload their profile
+        self.session_manager.invalidate_user(user['_id'])
+        token = self.session_manager.create_session(user)
+        st.session_state.user_id = str(user['_id'])
+        st.session_state.session_token = token
+        if self.session_manager.token_in_url:
+            # Opt-in: lets a reload restore the session instead of asking for a login
+            st.query_params['session'] = token
+
+    def restore_session(self):
+        token = st.query_params.get('session')
+        if token and not self.session_manager.token_in_url:
+            # Never honour (or keep showing) a token someone put in the URL when the feature is off
+            del st.query_params['session']
+            return
+        try:
+            profile = self.session_manager.get_profile(token) if token else None
+        except SessionUnavailable:
+            # Keep the token so the next rerun can restore the session once the database is back
+            return
+        if profile is None:
+            if token:
+                del st.query_params['session']
+            return
+        st.session_state.user_id = profile['id']
+        st.session_state.session_token = token
+
+    def logout(self):
+        self.session_manager.revoke(st.session_state.session_token)
+        st.query_params.clear()
+        st.session_state.clear()
+
     def show_profile_section(self):
-        user = self.db_handler.get_user_by_id(st.session_state.user_id)
+        user = self.current_profile()
         st.markdown("""
         <style>
             .profile-header {
@@ -558,7 +595,7 @@ window.addEventListener('load', async () => {
             <div class="profile-avatar">👤</div>
             <h1 class="profile-name">{user['username']}</h1>
             <p class="profile-email">✉️ {user['email']}</p>
-            <p class="profile-member-since">🎵 Member since {user['createdAt'].strftime('%B %Y')}</p>
+            <p class="profile-member-since">🎵 Member since {user['created_at'].strftime('%B %Y')}</p>
         </div>
         """, unsafe_allow_html=True)
         col1, col2, col3 = st.columns([1, 1, 1])
@@ -566,21 +603,21 @@ window.addEventListener('load', async () => {
             if st.button("⬅️ Back to Music Discovery", use_container_width=True, key="back_to_app"):
                 st.session_state.show_profile = False
                 st.rerun()
-        liked_tracks = self.get_user_liked_tracks(st.session_state.user_id)
-        unique_moods = set(track.get('mood', 'Unknown') for track in liked_tracks)
-        unique_genres = set(track.get('genre', 'Unknown') for track in liked_tracks)
+        stats = self.db_handler.get_user_stats(st.session_state.user_id)
+        total_tracks = stats.get('total_tracks', 0)
+        unique_moods = stats.get('mood_distribution', {}).keys()
         st.markdown('<div class="stats-container">', unsafe_allow_html=True)
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.markdown(f"""<div class="stat-card"><div class="stat-number">💖<br>{len(liked_tracks)}</div><div class="stat-label">Loved Tracks</div></div>""", unsafe_allow_html=True)
+            st.markdown(f"""<div class="stat-card"><div class="stat-number">💖<br>{total_tracks}</div><div class="stat-label">Loved Tracks</div></div>""", unsafe_allow_html=True)
         with col2:
-            st.markdown(f"""<div class="stat-card"><div class="stat-number">🎭<br>{len(unique_moods)}</div><div class="stat-label">Moods Explored</div></div>""", unsafe_allow_html=True)
+            st.markdown(f"""<div class="stat-card"><div class="stat-number">🎭<br>{stats.get('mood_diversity', 0)}</div><div class="stat-label">Moods Explored</div></div>""", unsafe_allow_html=True)
         with col3:
-            st.markdown(f"""<div class="stat-card"><div class="stat-number">🎼<br>{len(unique_genres)}</div><div class="stat-label">Genres Enjoyed</div></div>""", unsafe_allow_html=True)
+            st.markdown(f"""<div class="stat-card"><div class="stat-number">🎼<br>{stats.get('genre_diversity', 0)}</div><div class="stat-label">Genres Enjoyed</div></div>""", unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('<div class="music-section">', unsafe_allow_html=True)
         st.markdown('<h2 class="section-title">💖 Your Musical Journey</h2>', unsafe_allow_html=True)
-        if not liked_tracks:
+        if not total_tracks:
             st.info("🎵 Your music collection is empty! Start liking songs to build your library.")
             st.markdown('</div>', unsafe_allow_html=True)
             return
@@ -591,18 +628,13 @@ window.addEventListener('load', async () => {
         with col2:
             sort_option = st.selectbox("📊 Sort by:", ["Most Recent", "Oldest First", "Artist A-Z", "Title A-Z"], key="profile_sort")
         st.markdown('</div>', unsafe_allow_html=True)
-        filtered_tracks = liked_tracks
-        if mood_filter != "All":
-            filtered_tracks = [t for t in filtered_tracks if t.get('mood', '').lower() == mood_filter.lower()]
-        if sort_option == "Most Recent":
-            filtered_tracks = sorted(filtered_tracks, key=lambda x: x.get('likedAt', datetime.min), reverse=True)
-        elif sort_option == "Oldest First":
-            filtered_tracks = sorted(filtered_tracks, key=lambda x: x.get('likedAt', datetime.min))
-        elif sort_option == "Artist A-Z":
-            filtered_tracks = sorted(filtered_tracks, key=lambda x: x.get('artist', '').lower())
-        elif sort_option == "Title A-Z":
-            filtered_tracks = sorted(filtered_tracks, key=lambda x: x.get('title', '').lower())
-        st.markdown(f"""<div style="text-align: center; padding: 15px; background: rgba(255,255,255,0.8); border-radius: 10px; margin: 20px 0; font-weight: bold; color: #333;">🎵 Showing {len(filtered_tracks)} of {len(liked_tracks)} tracks</div>""", unsafe_allow_html=True)
+        sort_keys = {"Most Recent": 'recent', "Oldest First": 'oldest', "Artist A-Z": 'artist', "Title A-Z": 'title'}
+        filtered_tracks = self.db_handler.get_user_liked_tracks(
+            st.session_state.user_id,
+            mood=None if mood_filter == "All" else mood_filter,
+            sort=sort_keys[sort_option]
+        )
+        st.markdown(f"""<div style="text-align: center; padding: 15px; background: rgba(255,255,255,0.8); border-radius: 10px; margin: 20px 0; font-weight: bold; color: #333;">🎵 Showing {len(filtered_tracks)} of {total_tracks} tracks</div>""", unsafe_allow_html=True)
         if mood_filter == "All":
             mood_groups = {}
             for track in filtered_tracks:
@@ -716,15 +748,8 @@ window.addEventListener('load', async () => {
         # Your button and logic remains the same
         if st.button("🔍 Analyze Text", use_container_width=True, key="analyze_text_btn"):
            if user_text.strip():
-              # Try Gemini first for exact emotions from your list
-               ext_mood, ext_conf = call_gemini_emotion_api(user_text)
-        
-               if ext_mood and ext_conf > 0.5:
-            # Use Gemini result
-                   mood, conf = ext_mood, ext_conf
-               else:
-            # Fallback to TextMoodAnalyzer
-                   mood, conf = self.text_analyzer.predict_mood(user_text)
+              # Gemini and TextMoodAnalyzer race under a latency budget; Gemini wins if it answers in time
+               mood, conf = self.emotion_detector.detect(user_text)
                st.session_state.current_mood, st.session_state.detection_confidence = mood, conf
                self.auto_generate_music(mood, conf)
                st.rerun()
@@ -744,6 +769,9 @@ window.addEventListener('load', async () => {
         st.set_page_config(page_title="🎵 Emotion-Driven Music App", page_icon="🎵", layout="wide")
         st.markdown("""<style>.main > div {padding-top: 1rem; padding-bottom: 2rem;} .stButton > button {width: 100%;} .mood-detected {background: linear-gradient(45deg, #4CAF50, #45a049); color: white; padding: 15px; border-radius: 10px; text-align: center; font-weight: bold; margin-bottom: 20px; box-shadow: 0 4px 15px rgba(0,0,0,0.2);} .confidence-high {background: linear-gradient(45deg, #4CAF50, #45a049);} .confidence-medium {background: linear-gradient(45deg, #FF9800, #F57C00);} .confidence-low {background: linear-gradient(45deg, #f44336, #d32f2f);}</style>""", unsafe_allow_html=True)
 
+        if st.session_state.user_id is None:
+            self.restore_session()
+
         if st.session_state.user_id is None:
             st.title("🎵 Welcome to the Emotion-Driven Music App")
             st.info("👈 Please login or register using the sidebar to continue.")
@@ -756,11 +784,17 @@ window.addEventListener('load', async () => {
                         password = st.text_input("🔒 Password", type="password")
                         if st.form_submit_button("🚀 Login", use_container_width=True):
                             if email and password:
-                                user = self.authenticate_user(email, password)
-                                if user:
-                                    st.session_state.user_id = str(user['_id'])
-                                    st.rerun()
-                                else: st.error("❌ Invalid credentials!")
+                                try:
+                                    user = self.authenticate_user(email, password)
+                                except HasherTimeout:
+                                    st.warning("⏳ Logging in is taking longer than usual. Please try again in a moment.")
+                                except HasherBusy:
+                                    st.warning("⏳ Lots of people are logging in right now. Please try again in a moment.")
+                                else:
+                                    if user:
+                                        self.start_session(user)
+                                        st.rerun()
+                                    else: st.error("❌ Invalid credentials!")
                 with tab2:
                     with st.form("register_form"):
                         username = st.text_input("👤 Username")
@@ -768,11 +802,26 @@ window.addEventListener('load', async () => {
                         password = st.text_input("🔒 Password", type="password")
                         if st.form_submit_button("📝 Register", use_container_width=True):
                             if username and email and password:
-                                if self.register_user(username, email, password):
-                                    st.success("✅ Registration successful! Please login.")
-                                else: st.error("❌ Registration failed! Email may exist.")
+                                try:
+                                    registered = self.register_user(username, email, password)
+                                except HasherBusy:
+                                    st.warning("⏳ Lots of people are signing up right now. Please try again in a moment.")
+                                else:
+                                    if registered:
+                                        st.success("✅ Registration successful! Please login.")
+                                    else: st.error("❌ Registration failed! Email may exist.")
             return
 
+        try:
+            profile = self.current_profile()
+        except SessionUnavailable:
+            st.error("⚠️ We can't reach the server right now. Please try again in a moment.")
+            return
+        if profile is None:
+            # The session expired or was revoked (e.g. logged out in another tab)
+            self.logout()
+            st.rerun()
+
         if st.session_state.get('show_profile', False):
             self.show_profile_section()
             return
@@ -781,19 +830,18 @@ window.addEventListener('load', async () => {
         with title_col:
             st.title("🎵 Emotion-Driven Music Recommendation")
         with menu_col:
-            user = self.db_handler.get_user_by_id(st.session_state.user_id)
+            user = self.current_profile()
             with st.popover(f"👤 {user['username']}", use_container_width=True):
                 
 
                 st.markdown(f"*{user['email']}*")
                 st.divider()
-                liked_tracks_count = len(self.get_user_liked_tracks(st.session_state.user_id))
-                st.metric("💖 Liked Tracks", liked_tracks_count)
+                st.metric("💖 Liked Tracks", user['liked_tracks_count'])
                 if st.button("👤 View Profile", use_container_width=True):
                     st.session_state.show_profile = True
                     st.rerun()
                 if st.button("🚪 Logout", use_container_width=True):
-                    st.session_state.clear()
+                    self.logout()
                     st.rerun()
                     
                 st.markdown("""
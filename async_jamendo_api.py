@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import requests
+
+
+class AsyncJamendoAPI:
+    # Pages run on worker threads through JamendoAPI, so they share its HTTP pools, rate
+    # limiter, circuit breaker, cache and single-flight instead of a second client stack
+    def __init__(self, jamendo_api, max_concurrency=8):
+        self.api = jamendo_api
+        self.max_concurrency = max_concurrency
+
+    async def _fetch_page(self, semaphore, request, limit, offset):
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(self.api.fetch_page, request, limit, offset)
+            except requests.exceptions.RequestException as e:
+                # One failed page should not sink the pages that did arrive
+                print(f"API request error (offset {offset}): {e}")
+                return []
+            except Exception as e:
+                print(f"Error processing tracks: {e}")
+                return []
+
+    async def _fetch_pages(self, request, limit, semaphore=None):
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        pages = await asyncio.gather(*(
+            self._fetch_page(semaphore, request, page_limit, offset)
+            for page_limit, offset in self.api.page_plan(limit)
+        ))
+        return self.api.merge_pages(pages)
+
+    async def fetch_tracks_by_mood(self, mood, limit=100):
+        try:
+            request = self.api.mood_request(mood)
+        except Exception as e:
+            print(f"Error processing tracks: {e}")
+            return []
+        return await self._fetch_pages(request, limit)
+
+    async def fetch_tracks_for_moods(self, moods, limit=100):
+        # One semaphore across every mood and page bounds the total requests in flight
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        moods = list(dict.fromkeys(mood.strip().lower() for mood in moods if isinstance(mood, str)))
+        results = await asyncio.gather(*(
+            self._fetch_pages(self.api.mood_request(mood), limit, semaphore) for mood in moods
+        ))
+        return dict(zip(moods, results))
+
+    async def search_tracks(self, query, limit=20):
+        return await self._fetch_pages(self.api.search_request(query), limit)
+
+    async def get_popular_tracks(self, limit=50):
+        return await self._fetch_pages(self.api.popular_request(), limit)
+
+    async def get_track_details(self, track_id):
+        return await asyncio.to_thread(self.api.get_track_details, track_id)
+
+    def run(self, coroutine):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        # Already inside an event loop (e.g. a notebook): run on a private loop in another thread
+        result = {}
+
+        def runner():
+            try:
+                result['value'] = asyncio.run(coroutine)
+            except BaseException as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=runner)
+        thread.start()
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def fetch_tracks_for_moods_sync(self, moods, limit=100):
+        return self.run(self.fetch_tracks_for_moods(moods, limit))
+
+    def fetch_tracks_by_mood_sync(self, mood, limit=100):
+        return self.run(self.fetch_tracks_by_mood(mood, limit))
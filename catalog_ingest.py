@@ -0,0 +1,45 @@
+import time
+
+
+class CatalogIngester:
+    def __init__(self, jamendo_api, store, page_size=200):
+        self.jamendo_api = jamendo_api
+        self.store = store
+        self.page_size = min(page_size, jamendo_api.MAX_PAGE_SIZE)
+
+    def _checkpoint_name(self, mood):
+        return f"mood:{mood}"
+
+    def ingest_mood(self, mood, max_pages=None):
+        mood = mood.strip().lower()
+        request = self.jamendo_api.mood_request(mood)
+        # Oldest first, so new uploads land after the checkpoint instead of shifting earlier pages
+        request = request._replace(params={**request.params, 'order': 'id'})
+        checkpoint = self.store.get_checkpoint(self._checkpoint_name(mood), {'offset': 0})
+        offset = checkpoint['offset']
+        pages = fetched = added = 0
+        while max_pages is None or pages < max_pages:
+            tracks = self.jamendo_api.fetch_page(request, self.page_size, offset, cached=False)
+            pages += 1
+            fetched += len(tracks)
+            added += self.store.upsert_tracks(tracks, mood=mood)
+            # Stored after the page is committed, so a crash at worst re-reads one page
+            offset += len(tracks)
+            self.store.set_checkpoint(self._checkpoint_name(mood), {'offset': offset, 'updated_at': time.time()})
+            if len(tracks) < self.page_size:
+                break
+        return {'mood': mood, 'pages': pages, 'fetched': fetched, 'added': added, 'offset': offset}
+
+    def ingest(self, moods, max_pages=None):
+        results = []
+        for mood in moods:
+            try:
+                results.append(self.ingest_mood(mood, max_pages))
+            except Exception as e:
+                # Keep the checkpoint where it is; the next run resumes from there
+                print(f"Error ingesting mood {mood}: {e}")
+                results.append({'mood': mood, 'error': str(e)})
+        return results
+
+    def reset(self, mood):
+        self.store.set_checkpoint(self._checkpoint_name(mood.strip().lower()), {'offset': 0})
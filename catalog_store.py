@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS tracks ('
+    ' id TEXT PRIMARY KEY, title TEXT, artist TEXT, genre TEXT, mood TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS track_moods (track_id TEXT NOT NULL, mood TEXT NOT NULL, PRIMARY KEY (track_id, mood))',
+    'CREATE TABLE IF NOT EXISTS track_speed (track_id TEXT NOT NULL, speed TEXT NOT NULL, PRIMARY KEY (track_id, speed))',
+    'CREATE TABLE IF NOT EXISTS track_instruments ('
+    ' track_id TEXT NOT NULL, instrument TEXT NOT NULL, PRIMARY KEY (track_id, instrument))',
+    'CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS tracks_genre ON tracks (genre)',
+    'CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS track_moods_mood ON track_moods (mood)',
+    'CREATE INDEX IF NOT EXISTS track_speed_speed ON track_speed (speed)',
+    'CREATE INDEX IF NOT EXISTS track_instruments_instrument ON track_instruments (instrument)',
+]
+
+# Multi-valued tags live in side tables so each value gets its own index entry
+TAG_TABLES = {
+    'mood': ('track_moods', 'mood'),
+    'speed': ('track_speed', 'speed'),
+    'instrument': ('track_instruments', 'instrument'),
+}
+
+
+def _primary_genre(track):
+    genre = track.get('genre', 'Unknown')
+    if isinstance(genre, list):
+        genre = genre[0] if genre else 'Unknown'
+    return str(genre).lower()
+
+
+class CatalogStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            self.conn.commit()
+
+    def upsert_tracks(self, tracks, mood=None):
+        # Returns how many of the tracks were not in the catalog before
+        added = 0
+        now = time.time()
+        with self._lock:
+            for track in tracks:
+                track_id = str(track['id'])
+                exists = self.conn.execute('SELECT 1 FROM tracks WHERE id = ?', (track_id,)).fetchone()
+                # Updated in place so the rowid (and iter_tracks' position) survives a re-ingest. The
+                # mood column keeps the listing the track was first seen in; every listing it appears
+                # in is recorded in track_moods
+                self.conn.execute(
+                    'INSERT INTO tracks (id, title, artist, genre, mood, data, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (id) DO UPDATE SET title = excluded.title, artist = excluded.artist, '
+                    'genre = excluded.genre, mood = COALESCE(tracks.mood, excluded.mood), data = excluded.data, '
+                    'updated_at = excluded.updated_at',
+                    (track_id, track.get('title'), track.get('artist'), _primary_genre(track),
+                     track.get('mood'), json.dumps(track), now)
+                )
+                # A track can be listed under several moods; each listing adds one
+                moods = {m.lower() for m in (mood, track.get('mood')) if m}
+                self.conn.executemany('INSERT OR IGNORE INTO track_moods VALUES (?, ?)', [(track_id, m) for m in moods])
+                # Speed and instrument tags describe the track itself, so the latest fetch replaces them
+                self.conn.execute('DELETE FROM track_speed WHERE track_id = ?', (track_id,))
+                self.conn.execute('DELETE FROM track_instruments WHERE track_id = ?', (track_id,))
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO track_speed VALUES (?, ?)',
+                    [(track_id, s.lower()) for s in track.get('speed') or []]
+                )
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO track_instruments VALUES (?, ?)',
+                    [(track_id, i.lower()) for i in track.get('instruments') or []]
+                )
+                if not exists:
+                    added += 1
+            self.conn.commit()
+        return added
+
+    @staticmethod
+    def _load(data, mood):
+        track = json.loads(data)
+        if mood:
+            track['mood'] = mood
+        return track
+
+    def get_track(self, track_id):
+        with self._lock:
+            row = self.conn.execute('SELECT data, mood FROM tracks WHERE id = ?', (str(track_id),)).fetchone()
+        return self._load(*row) if row else None
+
+    def get_tracks(self, track_ids):
+        # Returned in the order asked for; ids missing from the catalog are skipped
+        track_ids = [str(track_id) for track_id in track_ids]
+        if not track_ids:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, data, mood FROM tracks WHERE id IN ({', '.join('?' * len(track_ids))})", track_ids
+            ).fetchall()
+        found = {track_id: self._load(data, mood) for track_id, data, mood in rows}
+        return [found[track_id] for track_id in track_ids if track_id in found]
+
+    def mood_listings(self, moods):
+        # Track id -> the first of the given moods it is listed under
+        moods = list(dict.fromkeys(m.strip().lower() for m in moods))
+        if not moods:
+            return {}
+        rank = {m: i for i, m in enumerate(moods)}
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT track_id, mood FROM track_moods WHERE mood IN ({', '.join('?' * len(moods))})", moods
+            ).fetchall()
+        listings = {}
+        for track_id, mood in rows:
+            if track_id not in listings or rank[mood] < rank[listings[track_id]]:
+                listings[track_id] = mood
+        return listings
+
+    def query(self, moods=None, genre=None, artist=None, speed=None, instrument=None, limit=None):
+        clauses, params = [], []
+        mood_column = 'mood'
+        if moods:
+            if isinstance(moods, str):
+                moods = [moods]
+            moods = list(dict.fromkeys(m.strip().lower() for m in moods))
+            placeholders = ', '.join('?' * len(moods))
+            # Tracks come back under the mood they were asked for (the first one, if several match),
+            # not whichever listing they happened to be stored from
+            ranks = ' '.join('WHEN ? THEN ?' for _ in moods)
+            mood_column = (
+                f"(SELECT m.mood FROM track_moods m WHERE m.track_id = tracks.id AND m.mood IN ({placeholders}) "
+                f"ORDER BY CASE m.mood {ranks} END LIMIT 1)"
+            )
+            params.extend(moods)
+            for rank, m in enumerate(moods):
+                params.extend((m, rank))
+            clauses.append(f"id IN (SELECT track_id FROM track_moods WHERE mood IN ({placeholders}))")
+            params.extend(moods)
+        if genre:
+            clauses.append('genre = ?')
+            params.append(genre.lower())
+        if artist:
+            clauses.append('artist = ? COLLATE NOCASE')
+            params.append(artist)
+        for name, value in (('speed', speed), ('instrument', instrument)):
+            if value:
+                table, column = TAG_TABLES[name]
+                clauses.append(f"id IN (SELECT track_id FROM {table} WHERE {column} = ?)")
+                params.append(value.lower())
+        sql = f'SELECT data, {mood_column} FROM tracks'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        # Catalog order, so a limit always picks the same tracks
+        sql += ' ORDER BY rowid'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._load(data, mood) for data, mood in rows]
+
+    def iter_tracks(self, batch_size=1000):
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    'SELECT rowid, data, mood FROM tracks WHERE rowid > ? ORDER BY rowid LIMIT ?', (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            for _, data, mood in rows:
+                yield self._load(data, mood)
+
+    def count(self, mood=None):
+        with self._lock:
+            if mood:
+                return self.conn.execute('SELECT COUNT(*) FROM track_moods WHERE mood = ?', (mood.lower(),)).fetchone()[0]
+            return self.conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def get_checkpoint(self, name, default=None):
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM checkpoints WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_checkpoint(self, name, value):
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
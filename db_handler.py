@@ -1,133 +1,758 @@
 import streamlit as st
 import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
-import bcrypt
+import numpy as np
+from track_features import TrackVectorizer
+from password_hasher import HasherBusy, PasswordHasher
 
 MONGO_URI = st.secrets["MONGO_URI"]
 
+USER_PROFILE_FIELDS = {'username': 1, 'email': 1, 'createdAt': 1, 'lastLogin': 1}
+USER_CREDENTIAL_FIELDS = {'_id': 1, 'password': 1}
+
+LIKED_TRACK_SORTS = {
+    'recent': [('likedAt', pymongo.DESCENDING)],
+    'oldest': [('likedAt', pymongo.ASCENDING)],
+    'artist': [('artist', pymongo.ASCENDING)],
+    'title': [('title', pymongo.ASCENDING)],
+}
+
 class MongoDBHandler:
-    def __init__(self):
+    def __init__(self, vectorizer=None, materialize_stats=True, password_hasher=None, write_behind=True,
+                 stats_max_age=86400):
         self.client = pymongo.MongoClient(MONGO_URI)
+        # Preference and stats bookkeeping after a like runs here, off the request path, in the order it was queued
+        self._worker_state = threading.local()
+        self._write_behind = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-write-behind',
+            initializer=lambda: setattr(self._worker_state, 'active', True)
+        ) if write_behind else None
+        # Like changes that are stored but whose preference deltas have not been applied yet, per
+        # user in the order made; rebuilds leave these out so the queued deltas are not counted twice
+        self._pending_changes = {}
+        self._pending_guard = threading.Lock()
+        # A like's write and its pending entry are recorded together under its user's stripe lock,
+        # so a rebuild never sees one without the other
+        self._ledger_locks = [threading.Lock() for _ in range(64)]
+        # Called with (user_id, delta) whenever a user's like count changes
+        self._likes_listeners = []
+        self.password_hasher = password_hasher or PasswordHasher()
         self.db = self.client['emotion_music_composer']
         self.users_collection = self.db['users']
+        self.liked_tracks_collection = self.db['liked_tracks']
+        self.preferences_collection = self.db['preference_vectors']
+        self.stats_collection = self.db['user_stats']
+        self.materialize_stats = materialize_stats
+        self.vectorizer = vectorizer or TrackVectorizer()
+        # Until migrate-likes has run, some users still keep their likes embedded in likedTracks
+        self._legacy_likes = self.users_collection.find_one({'likedTracks': {'$exists': True}}, {'_id': 1}) is not None
+        self.users_collection.create_index('email')
+        self.liked_tracks_collection.create_index(
+            [('userId', pymongo.ASCENDING), ('mood', pymongo.ASCENDING), ('likedAt', pymongo.ASCENDING)]
+        )
+        self.liked_tracks_collection.create_index(
+            [('userId', pymongo.ASCENDING), ('trackId', pymongo.ASCENDING)],
+            unique=True
+        )
+        self.preferences_collection.create_index(
+            [('userId', pymongo.ASCENDING), ('mood', pymongo.ASCENDING), ('schemaId', pymongo.ASCENDING)],
+            unique=True
+        )
+        # Backstop for materialized stats: even a copy that missed an invalidation is recomputed eventually
+        self.stats_collection.create_index('computedAt', expireAfterSeconds=stats_max_age)
+        self.sessions_collection = self.db['sessions']
+        # Expired sessions are removed by MongoDB's TTL monitor
+        self.sessions_collection.create_index('expiresAt', expireAfterSeconds=0)
+        self.sessions_collection.create_index('userId')
+
+    def ping(self):
+        try:
+            self.client.admin.command('ping')
+            return True
+        except Exception as e:
+            print(f"Error pinging database: {e}")
+            return False
+
+    def close(self):
+        if self._write_behind is not None:
+            self._write_behind.shutdown(wait=True)
+        self.client.close()
 
     def create_user(self, username, email, password):
         try:
             if self.users_collection.find_one({'email': email}):
                 return None
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = self.password_hasher.hash(password)
             user_data = {
                 'username': username,
                 'email': email,
                 'password': hashed_password,
-                'likedTracks': [],
                 'createdAt': datetime.now(),
                 'lastLogin': None
             }
             result = self.users_collection.insert_one(user_data)
             return str(result.inserted_id)
+        except HasherBusy:
+            raise
         except Exception as e:
             print(f"Error creating user: {e}")
             return None
 
+    def get_user_credentials(self, email):
+        try:
+            return self.users_collection.find_one({'email': email}, USER_CREDENTIAL_FIELDS)
+        except Exception as e:
+            print(f"Error getting user credentials: {e}")
+            return None
+
     def authenticate_user(self, email, password):
         try:
-            user = self.users_collection.find_one({'email': email})
-            if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
-                self.users_collection.update_one(
-                    {'_id': user['_id']},
-                    {'$set': {'lastLogin': datetime.now()}}
+            credentials = self.get_user_credentials(email)
+            if credentials and self.password_hasher.verify(password, credentials['password']):
+                if self.password_hasher.needs_rehash(credentials['password']):
+                    self._rehash_password(credentials, password)
+                self.invalidate_user_stats(credentials['_id'])
+                # Stamps the login and returns the lean profile in the same round trip
+                return self.users_collection.find_one_and_update(
+                    {'_id': credentials['_id']},
+                    {'$set': {'lastLogin': datetime.now()}},
+                    projection=USER_PROFILE_FIELDS,
+                    return_document=pymongo.ReturnDocument.AFTER
                 )
-                return user
             return None
+        except HasherBusy:
+            raise
         except Exception as e:
             print(f"Error authenticating user: {e}")
             return None
 
+    def _rehash_password(self, credentials, password):
+        # The cost factor changed since this hash was made; upgrade it in the background
+        try:
+            future = self.password_hasher.hash_async(password, kind='rehashes')
+        except HasherBusy:
+            return  # Try again on a later login
+
+        def store(done):
+            try:
+                # Conditional on the old hash, so a password change in the meantime wins
+                self.users_collection.update_one(
+                    {'_id': credentials['_id'], 'password': credentials['password']},
+                    {'$set': {'password': done.result()}}
+                )
+            except Exception as e:
+                print(f"Error rehashing password: {e}")
+
+        future.add_done_callback(store)
+
     def get_user_by_id(self, user_id):
         try:
-            return self.users_collection.find_one({'_id': ObjectId(user_id)})
+            return self.users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
         except Exception as e:
             print(f"Error getting user: {e}")
             return None
 
+    def get_user_profile(self, user_id):
+        # Database errors propagate, so a session check can tell an outage from a deleted user
+        try:
+            user_id = ObjectId(user_id)
+        except (InvalidId, TypeError):
+            return None
+        return self.users_collection.find_one({'_id': user_id}, USER_PROFILE_FIELDS)
+
+    def count_liked_tracks(self, user_id):
+        try:
+            if self._legacy_likes:
+                return len(self.get_liked_track_ids(user_id))
+            return self.liked_tracks_collection.count_documents({'userId': ObjectId(user_id)})
+        except Exception as e:
+            print(f"Error counting liked tracks: {e}")
+            return 0
+
+    def _liked_track_document(self, user_id, track):
+        return {
+            'userId': ObjectId(user_id),
+            'trackId': track.get('id') or track.get('trackId'),
+            'title': track['title'],
+            'artist': track['artist'],
+            'genre': track['genre'],
+            'mood': track['mood'],
+            'album': track.get('album', 'Unknown'),
+            'duration': track.get('duration', 0),
+            'likedAt': track.get('likedAt') or datetime.now()
+        }
+
+    def _legacy_liked_tracks(self, user_id, mood=None):
+        # Embedded likes not yet moved to liked_tracks, shaped like liked_tracks documents
+        if not self._legacy_likes:
+            return []
+        user = self.users_collection.find_one({'_id': ObjectId(user_id)}, {'likedTracks': 1})
+        tracks = []
+        for track in (user or {}).get('likedTracks') or []:
+            try:
+                doc = self._liked_track_document(user_id, track)
+            except (KeyError, TypeError, AttributeError):
+                continue
+            if mood and doc['mood'] != mood:
+                continue
+            del doc['userId']
+            # Older entries have no like time; they predate everything in liked_tracks
+            doc['likedAt'] = track.get('likedAt') or datetime.min
+            tracks.append(doc)
+        return tracks
+
+    def _legacy_liked_track_ids(self, user_id):
+        # A track liked before the migration must not be liked again in liked_tracks
+        if not self._legacy_likes:
+            return set()
+        user = self.users_collection.find_one(
+            {'_id': ObjectId(user_id)}, {'likedTracks.id': 1, 'likedTracks.trackId': 1}
+        )
+        return {
+            track.get('id') or track.get('trackId')
+            for track in (user or {}).get('likedTracks') or []
+            if isinstance(track, dict)
+        }
+
+    def _liked_track_upsert(self, user_id, track):
+        doc = self._liked_track_document(user_id, track)
+        # Inserts only when the (userId, trackId) pair is new; an existing like is left untouched
+        query = {'userId': doc['userId'], 'trackId': doc['trackId']}
+        on_insert = {key: value for key, value in doc.items() if key not in query}
+        return query, {'$setOnInsert': on_insert}, doc
+
+    def add_likes_listener(self, listener):
+        self._likes_listeners.append(listener)
+
+    def _notify_likes_changed(self, user_id, delta):
+        for listener in self._likes_listeners:
+            try:
+                listener(str(user_id), delta)
+            except Exception as e:
+                print(f"Error notifying like count change: {e}")
+
+    def _ledger_lock(self, user_id):
+        return self._ledger_locks[hash(str(user_id)) % len(self._ledger_locks)]
+
+    def _record_pending(self, user_id, tracks, sign):
+        # Call with the user's ledger lock held, right after the write
+        change = {'sign': sign, 'tracks': tracks}
+        with self._pending_guard:
+            self._pending_changes.setdefault(str(user_id), []).append(change)
+        return change
+
+    def _settle(self, user_id, change):
+        with self._pending_guard:
+            changes = self._pending_changes.get(str(user_id), [])
+            changes.remove(change)
+            if not changes:
+                self._pending_changes.pop(str(user_id), None)
+
+    def _pending_for(self, user_id):
+        with self._pending_guard:
+            return list(self._pending_changes.get(str(user_id), []))
+
+    def _after_likes_changed(self, user_id, change):
+        self._notify_likes_changed(user_id, change['sign'] * len(change['tracks']))
+
+        def apply():
+            # Counted from here on: a rebuild the delta triggers (no vector yet) must include it
+            self._settle(user_id, change)
+            self._apply_preference_deltas(user_id, change['tracks'], change['sign'])
+            self.invalidate_user_stats(user_id)
+
+        self._enqueue(apply)
+
+    def _enqueue(self, job):
+        # Deltas and rebuilds run one at a time, in order, on the write-behind thread
+        if self._write_behind is not None:
+            try:
+                self._write_behind.submit(job)
+                return
+            except RuntimeError:
+                # Shut down by close(); the like itself is already stored, so finish the bookkeeping here
+                pass
+        job()
+
+    def _run_serialized(self, job):
+        # Runs job on the write-behind thread (waiting for it), so it cannot interleave with deltas
+        if self._write_behind is None or getattr(self._worker_state, 'active', False):
+            return job()
+        try:
+            future = self._write_behind.submit(job)
+        except RuntimeError:
+            return job()
+        return future.result()
+
+    def schedule_preference_rebuild(self, user_id, mood=None):
+        def rebuild():
+            self.rebuild_preference_vectors(user_id, mood=mood)
+            self.invalidate_user_stats(user_id)
+
+        self._enqueue(rebuild)
+
+    def flush(self):
+        # Waits until everything queued so far has been written
+        if self._write_behind is not None:
+            try:
+                self._write_behind.submit(lambda: None).result()
+            except RuntimeError:
+                pass
+
     def add_liked_track(self, user_id, track):
         try:
-            track_id = track.get('id') or track.get('trackId')
-            exists = self.users_collection.find_one({
-                '_id': ObjectId(user_id),
-                'likedTracks.trackId': track_id
-            })
-            if exists:
+            query, update, doc = self._liked_track_upsert(user_id, track)
+            if doc['trackId'] in self._legacy_liked_track_ids(user_id):
                 return False
-            track_data = {
-                'trackId': track_id,
-                'title': track['title'],
-                'artist': track['artist'],
-                'genre': track['genre'],
-                'mood': track['mood'],
-                'album': track.get('album', 'Unknown'),
-                'duration': track.get('duration', 0),
-                'likedAt': datetime.now()
-            }
-            result = self.users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$push': {'likedTracks': track_data}}
-            )
-            return result.modified_count > 0
+            with self._ledger_lock(user_id):
+                # One round trip: the upsert both checks for and records the like
+                result = self.liked_tracks_collection.update_one(query, update, upsert=True)
+                if result.upserted_id is None:
+                    return False
+                change = self._record_pending(user_id, [doc], 1)
+            self._after_likes_changed(user_id, change)
+            return True
+        except DuplicateKeyError:
+            # A concurrent double-click won the race for the unique index
+            return False
         except Exception as e:
             print(f"Error adding liked track: {e}")
             return False
 
-    def get_user_liked_tracks(self, user_id, mood=None):
+    def bulk_like(self, user_id, tracks, batch_size=1000):
+        # Returns how many of the tracks were newly liked
+        seen = self._legacy_liked_track_ids(user_id)
+        pending = []
+        for track in tracks:
+            query, update, doc = self._liked_track_upsert(user_id, track)
+            if doc['trackId'] in seen:
+                continue
+            seen.add(doc['trackId'])
+            # A client-chosen _id tells which documents the upserts created
+            doc['_id'] = update['$setOnInsert']['_id'] = ObjectId()
+            pending.append((UpdateOne(query, update, upsert=True), doc))
+        added = []
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with self._ledger_lock(user_id):
+                try:
+                    result = self.liked_tracks_collection.bulk_write([operation for operation, _ in batch], ordered=False)
+                    upserted = result.upserted_ids.values()
+                except BulkWriteError as e:
+                    errors = e.details.get('writeErrors', [])
+                    if any(error.get('code') != 11000 for error in errors):
+                        raise
+                    upserted = [item['_id'] for item in e.details.get('upserted', [])]
+                by_id = {doc['_id']: doc for _, doc in batch}
+                batch_added = [by_id[doc_id] for doc_id in upserted if doc_id in by_id]
+                change = self._record_pending(user_id, batch_added, 1) if batch_added else None
+            if change:
+                self._after_likes_changed(user_id, change)
+                added.extend(batch_added)
+        return len(added)
+
+    def get_user_liked_tracks(self, user_id, mood=None, sort='oldest', limit=0):
         try:
-            user = self.users_collection.find_one({'_id': ObjectId(user_id)})
-            if not user:
-                return []
-            liked_tracks = user.get('likedTracks', [])
+            query = {'userId': ObjectId(user_id)}
             if mood:
-                liked_tracks = [t for t in liked_tracks if t.get('mood') == mood]
-            return liked_tracks
+                query['mood'] = mood
+            cursor = self.liked_tracks_collection.find(query, {'_id': 0, 'userId': 0})
+            cursor = cursor.sort(LIKED_TRACK_SORTS.get(sort, LIKED_TRACK_SORTS['oldest']))
+            if sort in ('artist', 'title'):
+                # Case-insensitive ordering, matching the A-Z sorts the profile page used to do in Python
+                cursor = cursor.collation({'locale': 'en', 'strength': 2})
+            legacy = self._legacy_liked_tracks(user_id, mood)
+            if not legacy:
+                if limit:
+                    cursor = cursor.limit(limit)
+                return list(cursor)
+            tracks = list(cursor)
+            seen = {track['trackId'] for track in tracks}
+            tracks.extend(track for track in legacy if track['trackId'] not in seen)
+            field, direction = LIKED_TRACK_SORTS.get(sort, LIKED_TRACK_SORTS['oldest'])[0]
+            if sort in ('artist', 'title'):
+                key = lambda track: str(track.get(field) or '').lower()
+            else:
+                key = lambda track: track.get(field) or datetime.min
+            tracks.sort(key=key, reverse=direction == pymongo.DESCENDING)
+            return tracks[:limit] if limit else tracks
         except Exception as e:
             print(f"Error getting liked tracks: {e}")
             return []
 
+    def get_liked_track_ids(self, user_id):
+        try:
+            # Covered by the (userId, trackId) index, so no track documents are fetched
+            cursor = self.liked_tracks_collection.find({'userId': ObjectId(user_id)}, {'_id': 0, 'trackId': 1})
+            track_ids = set(doc['trackId'] for doc in cursor)
+            track_ids.update(track['trackId'] for track in self._legacy_liked_tracks(user_id))
+            return track_ids
+        except Exception as e:
+            print(f"Error getting liked track ids: {e}")
+            return set()
+
     def remove_liked_track(self, user_id, track_id):
         try:
-            result = self.users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$pull': {'likedTracks': {'trackId': track_id}}}
-            )
-            return result.modified_count > 0
+            with self._ledger_lock(user_id):
+                track = self.liked_tracks_collection.find_one_and_delete(
+                    {'userId': ObjectId(user_id), 'trackId': track_id}
+                )
+                change = self._record_pending(user_id, [track], -1) if track else None
+            if not track:
+                return self._remove_legacy_liked_track(user_id, track_id)
+            self._after_likes_changed(user_id, change)
+            return True
         except Exception as e:
             print(f"Error removing liked track: {e}")
             return False
 
+    def _remove_legacy_liked_track(self, user_id, track_id):
+        if not self._legacy_likes:
+            return False
+        for field in ('id', 'trackId'):
+            result = self.users_collection.update_one(
+                {'_id': ObjectId(user_id)}, {'$pull': {'likedTracks': {field: track_id}}}
+            )
+            if result.modified_count:
+                break
+        else:
+            return False
+        self._notify_likes_changed(user_id, -1)
+        self.schedule_preference_rebuild(user_id)
+        return True
+
+    def bulk_unlike(self, user_id, track_ids, batch_size=1000):
+        # Returns how many likes were removed
+        track_ids = list(dict.fromkeys(track_ids))
+        removed = 0
+        for start in range(0, len(track_ids), batch_size):
+            batch = track_ids[start:start + batch_size]
+            # The documents are needed anyway to know which preference columns to decrement
+            with self._ledger_lock(user_id):
+                docs = list(self.liked_tracks_collection.find(
+                    {'userId': ObjectId(user_id), 'trackId': {'$in': batch}},
+                    {'_id': 1, 'trackId': 1, 'genre': 1, 'mood': 1, 'artist': 1}
+                ))
+                if not docs:
+                    continue
+                result = self.liked_tracks_collection.delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+                complete = result.deleted_count == len(docs)
+                change = self._record_pending(user_id, docs, -1) if complete else None
+            removed += result.deleted_count
+            if complete:
+                self._after_likes_changed(user_id, change)
+            else:
+                # Someone else removed some of these meanwhile; the deltas are unknown, so recount
+                self._notify_likes_changed(user_id, -result.deleted_count)
+                self.schedule_preference_rebuild(user_id)
+        return removed
+
+    def migrate_liked_tracks(self):
+        migrated_users = 0
+        migrated_tracks = 0
+        for user in self.users_collection.find({'likedTracks': {'$exists': True}}, {'likedTracks': 1}):
+            docs, rejected = [], []
+            for track in user.get('likedTracks') or []:
+                try:
+                    docs.append(self._liked_track_document(user['_id'], track))
+                except (KeyError, TypeError, AttributeError) as e:
+                    print(f"Skipping malformed liked track for user {user['_id']}: {e!r}")
+                    rejected.append(track)
+            if docs:
+                try:
+                    result = self.liked_tracks_collection.insert_many(docs, ordered=False)
+                    migrated_tracks += len(result.inserted_ids)
+                except BulkWriteError as e:
+                    # Duplicates are expected when a migration is re-run or the old array held repeats
+                    errors = e.details.get('writeErrors', [])
+                    if any(error.get('code') != 11000 for error in errors):
+                        print(f"Could not migrate liked tracks for user {user['_id']}; leaving them embedded: {errors[:3]}")
+                        continue
+                    migrated_tracks += e.details.get('nInserted', 0)
+                except Exception as e:
+                    print(f"Could not migrate liked tracks for user {user['_id']}; leaving them embedded: {e}")
+                    continue
+            # Only once the inserts are confirmed; entries that could not be read are kept for inspection
+            update = {'$unset': {'likedTracks': ''}}
+            if rejected:
+                update['$set'] = {'likedTracksRejected': rejected}
+            self.users_collection.update_one({'_id': user['_id']}, update)
+            self.rebuild_preference_vectors(user['_id'])
+            self.invalidate_user_stats(user['_id'])
+            migrated_users += 1
+        self._legacy_likes = self.users_collection.find_one({'likedTracks': {'$exists': True}}, {'_id': 1}) is not None
+        return migrated_users, migrated_tracks
+
+    def _preference_increments(self, tracks, sign=1):
+        if not tracks:
+            return {}
+        # Track vectors are sparse, so only the touched columns are stored and incremented
+        column_sums = self.vectorizer.vectorize_tracks(tracks).sum(axis=0, dtype=np.float64)
+        return {f'sums.{column}': sign * float(column_sums[column]) for column in np.flatnonzero(column_sums)}
+
+    def _apply_preference_deltas(self, user_id, tracks, sign):
+        # One $inc per touched mood, however many tracks changed
+        try:
+            by_mood = {}
+            for track in tracks:
+                by_mood.setdefault(track.get('mood'), []).append(track)
+            for mood, mood_tracks in by_mood.items():
+                increments = self._preference_increments(mood_tracks, sign)
+                increments['count'] = sign * len(mood_tracks)
+                result = self.preferences_collection.update_one(
+                    {'userId': ObjectId(user_id), 'mood': mood, 'schemaId': self.vectorizer.schema_id},
+                    {'$inc': increments, '$set': {'updatedAt': datetime.now()}}
+                )
+                if result.matched_count == 0:
+                    # Never built (e.g. likes that predate the store): an $inc from zero would
+                    # leave a partial vector, so build it from the likes, which already include this change
+                    self.rebuild_preference_vectors(user_id, mood=mood)
+        except Exception as e:
+            print(f"Error updating preference vector: {e}")
+
+    def get_preference_vector(self, user_id, mood):
+        try:
+            doc = self.preferences_collection.find_one(
+                {'userId': ObjectId(user_id), 'mood': mood, 'schemaId': self.vectorizer.schema_id},
+                {'sums': 1, 'count': 1}
+            )
+            if doc is None:
+                return None
+            sums = np.zeros(self.vectorizer.vector_size, dtype=np.float32)
+            for column, value in doc.get('sums', {}).items():
+                sums[int(column)] = value
+            return sums, doc.get('count', 0)
+        except Exception as e:
+            print(f"Error getting preference vector: {e}")
+            return None
+
+    def _preference_document(self, user_id, mood, tracks):
+        return {
+            'userId': user_id,
+            'mood': mood,
+            'schemaId': self.vectorizer.schema_id,
+            'sums': {key.split('.', 1)[1]: value for key, value in self._preference_increments(tracks).items()},
+            'count': len(tracks),
+            'updatedAt': datetime.now()
+        }
+
+    def _counted_likes(self, uid, mood):
+        # The likes the stored vectors should reflect: what is in the database, minus changes
+        # whose deltas are still queued (undone newest first)
+        with self._ledger_lock(uid):
+            tracks = {track['trackId']: track for track in self.get_user_liked_tracks(uid, mood)}
+            pending = self._pending_for(uid)
+        for change in reversed(pending):
+            for track in change['tracks']:
+                if mood is not None and track.get('mood') != mood:
+                    continue
+                if change['sign'] > 0:
+                    tracks.pop(track['trackId'], None)
+                else:
+                    tracks[track['trackId']] = track
+        return list(tracks.values())
+
+    def rebuild_preference_vectors(self, user_id=None, mood=None):
+        if user_id:
+            user_ids = [ObjectId(user_id)]
+        else:
+            user_ids = [user['_id'] for user in self.users_collection.find({}, {'_id': 1})]
+        for uid in user_ids:
+            self._run_serialized(lambda: self._rebuild_user_preferences(uid, mood))
+        return len(user_ids)
+
+    def _rebuild_user_preferences(self, uid, mood=None):
+        schema_id = self.vectorizer.schema_id
+        by_mood = {}
+        for track in self._counted_likes(uid, mood):
+            by_mood.setdefault(track.get('mood'), []).append(track)
+        # Each (user, mood) vector is replaced in place, so readers and concurrent $inc
+        # updates never see it missing or collide on the unique index
+        for track_mood, tracks in by_mood.items():
+            self.preferences_collection.replace_one(
+                {'userId': uid, 'mood': track_mood, 'schemaId': schema_id},
+                self._preference_document(uid, track_mood, tracks),
+                upsert=True
+            )
+        stale = {'userId': uid}
+        if mood is not None:
+            if by_mood:
+                return
+            stale.update({'mood': mood, 'schemaId': schema_id})
+        else:
+            stale['$or'] = [{'schemaId': {'$ne': schema_id}}, {'mood': {'$nin': list(by_mood)}}]
+        self.preferences_collection.delete_many(stale)
+
+    def _stats_pipeline(self, user_id):
+        def counts(key, limit=None):
+            stages = [{'$group': {'_id': key, 'count': {'$sum': 1}}}, {'$sort': {'count': -1, '_id': 1}}]
+            if limit:
+                stages.append({'$limit': limit})
+            return stages
+
+        # Genres from Jamendo vartags can be arrays; count those by their first tag
+        genre = {'$cond': [
+            {'$isArray': '$genre'},
+            {'$ifNull': [{'$first': '$genre'}, 'Unknown']},
+            {'$ifNull': ['$genre', 'Unknown']}
+        ]}
+        return [
+            {'$match': {'_id': ObjectId(user_id)}},
+            {'$project': {'createdAt': 1, 'lastLogin': 1}},
+            {'$lookup': {
+                'from': self.liked_tracks_collection.name,
+                'localField': '_id',
+                'foreignField': 'userId',
+                'as': 'likes',
+                'pipeline': [{'$facet': {
+                    'totals': [{'$group': {
+                        '_id': None,
+                        'tracks': {'$sum': 1},
+                        'duration': {'$sum': {'$ifNull': ['$duration', 0]}}
+                    }}],
+                    'moods': counts({'$ifNull': ['$mood', 'unknown']}),
+                    'genres': counts(genre),
+                    'artists': counts({'$ifNull': ['$artist', 'Unknown']}, limit=5)
+                }}]
+            }},
+            {'$unwind': '$likes'}
+        ]
+
+    def _legacy_user_stats(self, user_id):
+        # The pipeline only sees liked_tracks; a user with unmigrated embedded likes gets the same
+        # raw shape computed in Python over both. None when the user has no embedded likes.
+        user = self.users_collection.find_one(
+            {'_id': ObjectId(user_id), 'likedTracks.0': {'$exists': True}},
+            {'createdAt': 1, 'lastLogin': 1}
+        )
+        if user is None:
+            return None
+        tracks = self.get_user_liked_tracks(user_id)
+
+        def counts(values, limit=None):
+            counter = {}
+            for value in values:
+                counter[value] = counter.get(value, 0) + 1
+            rows = sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))
+            return [{'_id': value, 'count': count} for value, count in rows[:limit]]
+
+        def field(track, key, default):
+            value = track.get(key)
+            if key == 'genre' and isinstance(value, list):
+                value = value[0] if value else None
+            return default if value is None else value
+
+        user['likes'] = {
+            'totals': [{
+                '_id': None,
+                'tracks': len(tracks),
+                'duration': sum(field(track, 'duration', 0) for track in tracks)
+            }] if tracks else [],
+            'moods': counts(field(track, 'mood', 'unknown') for track in tracks),
+            'genres': counts(field(track, 'genre', 'Unknown') for track in tracks),
+            'artists': counts((field(track, 'artist', 'Unknown') for track in tracks), limit=5)
+        }
+        return user
+
+    def _format_user_stats(self, raw):
+        likes = raw.get('likes', {})
+        totals = likes.get('totals') or [{'tracks': 0, 'duration': 0}]
+        mood_counts = {row['_id']: row['count'] for row in likes.get('moods', [])}
+        genre_counts = {row['_id']: row['count'] for row in likes.get('genres', [])}
+        return {
+            'total_tracks': totals[0]['tracks'],
+            'total_duration_minutes': totals[0]['duration'] // 60,
+            'mood_distribution': mood_counts,
+            'genre_distribution': genre_counts,
+            'favorite_moods': dict(list(mood_counts.items())[:5]),
+            'favorite_genres': dict(list(genre_counts.items())[:5]),
+            'favorite_artists': {row['_id']: row['count'] for row in likes.get('artists', [])},
+            'mood_diversity': len(mood_counts),
+            'genre_diversity': len(genre_counts),
+            'account_created': raw.get('createdAt'),
+            'last_login': raw.get('lastLogin')
+        }
+
     def get_user_stats(self, user_id):
         try:
-            user = self.users_collection.find_one({'_id': ObjectId(user_id)})
-            if not user:
-                return {}
-            liked_tracks = user.get('likedTracks', [])
-            mood_counts = {}
-            genre_counts = {}
-            total_duration = 0
-            for track in liked_tracks:
-                mood = track.get('mood', 'unknown')
-                genre = track.get('genre', 'Unknown')
-                duration = track.get('duration', 0)
-                mood_counts[mood] = mood_counts.get(mood, 0) + 1
-                genre_counts[genre] = genre_counts.get(genre, 0) + 1
-                total_duration += duration
-            return {
-                'total_tracks': len(liked_tracks),
-                'total_duration_minutes': total_duration // 60,
-                'mood_distribution': mood_counts,
-                'genre_distribution': genre_counts,
-                'account_created': user.get('createdAt'),
-                'last_login': user.get('lastLogin')
-            }
+            cached = None
+            if self.materialize_stats:
+                cached = self.stats_collection.find_one({'_id': ObjectId(user_id)})
+                if cached and 'stats' in cached:
+                    return self._format_user_stats(cached['stats'])
+            raw = self._legacy_user_stats(user_id) if self._legacy_likes else None
+            if raw is None:
+                result = list(self.users_collection.aggregate(self._stats_pipeline(user_id)))
+                if not result:
+                    return {}
+                raw = result[0]
+            if self.materialize_stats:
+                self._store_user_stats(raw, cached)
+            return self._format_user_stats(raw)
         except Exception as e:
             print(f"Error getting user stats: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    def _store_user_stats(self, raw, cached):
+        # The raw facet output is stored, since mood and genre values are not safe field names.
+        # It is only written if no invalidation bumped the version while it was being computed;
+        # otherwise the next read recomputes.
+        version = (cached or {}).get('version', 0)
+        doc = {'_id': raw['_id'], 'version': version, 'stats': raw, 'computedAt': datetime.now()}
+        if cached is None:
+            try:
+                self.stats_collection.insert_one(doc)
+            except DuplicateKeyError:
+                pass
+            return
+        # Documents from before versioning have no version field
+        current = version if 'version' in cached else {'$exists': False}
+        self.stats_collection.replace_one({'_id': raw['_id'], 'version': current}, doc)
+
+    def invalidate_user_stats(self, user_id):
+        if not self.materialize_stats:
+            return
+        try:
+            self.stats_collection.update_one(
+                {'_id': ObjectId(user_id)},
+                {'$inc': {'version': 1}, '$unset': {'stats': '', 'computedAt': ''}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error invalidating user stats: {e}")
+
+    def create_session(self, session_id, user_id, expires_at):
+        try:
+            self.sessions_collection.insert_one({
+                '_id': session_id,
+                'userId': ObjectId(user_id),
+                'createdAt': datetime.now(),
+                'expiresAt': expires_at
+            })
+            return True
+        except Exception as e:
+            print(f"Error creating session: {e}")
+            return False
+
+    def get_session(self, session_id):
+        # None only when the session is really gone; database errors propagate
+        return self.sessions_collection.find_one({'_id': session_id})
+
+    def delete_session(self, session_id):
+        try:
+            self.sessions_collection.delete_one({'_id': session_id})
+        except Exception as e:
+            print(f"Error deleting session: {e}")
+
+    def delete_user_sessions(self, user_id):
+        try:
+            return self.sessions_collection.delete_many({'userId': ObjectId(user_id)}).deleted_count
+        except Exception as e:
+            print(f"Error deleting user sessions: {e}")
+            return 0
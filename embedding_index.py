@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import numpy as np
+
+VECTORS_FILE = 'vectors.f32'
+SNAPSHOT_FILE = 'snapshot.npz'
+META_FILE = 'meta.json'
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+    norms[norms == 0] = 1
+    return matrix / norms[:, np.newaxis]
+
+
+class EmbeddingIndex:
+    # Rows are L2-normalized track vectors in a memory-mapped float32 file, so a dot
+    # product is the cosine similarity. An IVF layer (spherical k-means centroids plus
+    # one inverted list per centroid) narrows a query to a few lists, whose rows are
+    # then scored exactly.
+    def __init__(self, directory, dim, schema_id=None, n_lists=64, nprobe=8, initial_capacity=1024):
+        self.directory = directory
+        self.dim = dim
+        self.schema_id = schema_id
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._snapshot_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self._reset(initial_capacity)
+        self._load()
+
+    def _reset(self, capacity):
+        self.count = 0
+        self.ids = []
+        self.rows = {}
+        self.centroids = None
+        self.assignments = np.zeros(capacity, dtype=np.int32)
+        self._lists = None
+        self._vectors = self._map(capacity)
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.directory, VECTORS_FILE)
+
+    def _map(self, capacity):
+        path = self._vectors_path
+        size = capacity * self.dim * 4
+        mode = 'r+' if os.path.exists(path) else 'w+'
+        if mode == 'r+' and os.path.getsize(path) < size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        return np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+
+    def _load(self):
+        meta_path = os.path.join(self.directory, META_FILE)
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not (os.path.exists(meta_path) and os.path.exists(snapshot_path)):
+            return
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('dim') != self.dim or meta.get('schema_id') != self.schema_id:
+            # Vectors from another feature layout are meaningless here; start over
+            print(f"Embedding index schema changed, rebuilding {self.directory}")
+            return
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            ids = [str(track_id) for track_id in snapshot['ids']]
+            assignments = snapshot['assignments']
+            centroids = snapshot['centroids'] if snapshot['centroids'].size else None
+        capacity = max(len(ids), len(self.assignments))
+        self._vectors = self._map(capacity)
+        # Rows written after the snapshot are ignored; the snapshot is the unit of durability
+        self.count = len(ids)
+        self.ids = ids
+        self.rows = {track_id: row for row, track_id in enumerate(ids)}
+        self.assignments = np.zeros(capacity, dtype=np.int32)
+        self.assignments[:self.count] = assignments
+        self.centroids = centroids
+        self._lists = None
+        self._snapshot_mtime = os.path.getmtime(snapshot_path)
+
+    def refresh(self):
+        # Picks up a snapshot written by another process (e.g. the maintenance CLI)
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        try:
+            mtime = os.path.getmtime(snapshot_path)
+        except OSError:
+            return False
+        if mtime == self._snapshot_mtime:
+            return False
+        with self._lock:
+            self._load()
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, needed):
+        capacity = len(self.assignments)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._vectors.flush()
+        self._vectors = self._map(capacity)
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self.count] = self.assignments[:self.count]
+        self.assignments = assignments
+
+    def add(self, ids, vectors):
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            rows = np.empty(len(ids), dtype=np.intp)
+            new_ids = [track_id for track_id in map(str, ids) if track_id not in self.rows]
+            self._grow(self.count + len(new_ids))
+            for i, track_id in enumerate(map(str, ids)):
+                row = self.rows.get(track_id)
+                if row is None:
+                    row = self.count
+                    self.rows[track_id] = row
+                    self.ids.append(track_id)
+                    self.count += 1
+                rows[i] = row
+            self._vectors[rows] = vectors
+            if self.centroids is not None:
+                self.assignments[rows] = self._assign(vectors)
+            self._lists = None
+        return len(new_ids)
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train(self, n_lists=None, iterations=10, sample_size=50000, seed=0):
+        with self._lock:
+            n_lists = min(n_lists or self.n_lists, self.count)
+            if n_lists < 1:
+                return
+            data = np.asarray(self._vectors[:self.count])
+            rng = np.random.default_rng(seed)
+            sample = data
+            if self.count > sample_size:
+                sample = data[rng.choice(self.count, sample_size, replace=False)]
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = ~np.any(sums, axis=1)
+                # Empty clusters keep their old centroid rather than collapsing to zero
+                sums[empty] = centroids[empty]
+                centroids = _normalize_rows(sums)
+            self.centroids = centroids.astype(np.float32)
+            self.assignments[:self.count] = self._assign(data)
+            self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            assignments = self.assignments[:self.count]
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        return self._lists
+
+    def search(self, query, k=10, nprobe=None, exclude_ids=None, include_ids=None):
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        norm = np.sqrt(np.dot(query, query))
+        if norm == 0 or k <= 0:
+            return []
+        query = query / norm
+        exclude_ids = exclude_ids or ()
+        with self._lock:
+            if self.count == 0:
+                return []
+            wanted = k + len(exclude_ids)
+            candidates = None
+            if include_ids is not None:
+                # A restricted search scores exactly the allowed rows instead of probing lists
+                candidates = np.array(sorted(self.rows[i] for i in include_ids if i in self.rows), dtype=np.intp)
+                if not len(candidates):
+                    return []
+            elif self.centroids is not None:
+                nprobe = min(nprobe or self.nprobe, len(self.centroids))
+                probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                lists = self._inverted_lists()
+                candidates = np.sort(np.concatenate([lists[c] for c in probes]))
+                if len(candidates) < wanted:
+                    candidates = None
+            if candidates is None:
+                # Untrained index or probes too thin to fill k: score everything
+                candidates = np.arange(self.count)
+            scores = np.asarray(self._vectors[candidates]) @ query
+            ids = self.ids
+        if wanted < len(scores):
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+            top = top[np.lexsort((candidates[top], -scores[top]))]
+        else:
+            top = np.lexsort((candidates, -scores))
+        results = []
+        for i in top:
+            track_id = ids[candidates[i]]
+            if track_id in exclude_ids:
+                continue
+            results.append((track_id, float(scores[i])))
+            if len(results) >= k:
+                break
+        return results
+
+    def snapshot(self):
+        with self._lock:
+            self._vectors.flush()
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+            meta_path = os.path.join(self.directory, META_FILE)
+            # Written to temporary names and swapped in, so readers never see half a snapshot
+            with open(snapshot_path + '.tmp', 'wb') as f:
+                np.savez(
+                    f,
+                    ids=np.array(self.ids, dtype=str),
+                    assignments=self.assignments[:self.count],
+                    centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype=np.float32)
+                )
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim, 'schema_id': self.schema_id, 'count': self.count}, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+            self._snapshot_mtime = os.path.getmtime(snapshot_path)
+
+    def close(self):
+        with self._lock:
+            self._vectors.flush()
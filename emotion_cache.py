@@ -0,0 +1,39 @@
+import hashlib
+import re
+from response_cache import LRUCache, SQLiteCache, TieredCache
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def normalize_text(text):
+    # "I'm SO happy!!" and "im so happy" share an entry
+    return ' '.join(PUNCTUATION_RE.sub('', text.lower()).split())
+
+
+class DetectionCache:
+    def __init__(self, max_entries=10000, ttl=86400, path=None):
+        self.cache = TieredCache(
+            memory=LRUCache(max_entries=max_entries),
+            disk=SQLiteCache(path) if path else None,
+            ttl=ttl,
+            stale_ttl=0
+        )
+
+    def _key_params(self, text):
+        return {'digest': hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()}
+
+    def get_or_detect(self, backend, text, detect):
+        # Each backend gets its own namespace; failed detections (no mood) are never cached
+        result = self.cache.get_or_load(
+            backend,
+            self._key_params(text),
+            lambda: detect(text),
+            should_cache=lambda value: bool(value and value[0])
+        )
+        return tuple(result)
+
+    def stats(self):
+        return self.cache.stats()
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class EmotionDetector:
+    def __init__(self, text_analyzer, gemini_detect, hedge_detect=None, cache=None, budget=3.0,
+                 hedge_after=None, min_gemini_confidence=0.5, max_workers=8, local_workers=4):
+        self.text_analyzer = text_analyzer
+        self.gemini_detect = gemini_detect
+        # Hedges must bypass request coalescing, otherwise they would just join the slow call
+        self.hedge_detect = hedge_detect or gemini_detect
+        self.cache = cache
+        self.budget = budget
+        self.hedge_after = hedge_after
+        self.min_gemini_confidence = min_gemini_confidence
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='emotion-detect')
+        # Abandoned Gemini calls can hold their workers for tens of seconds (timeouts times retries),
+        # so the local fallback gets its own pool and never queues behind them
+        self.local_executor = ThreadPoolExecutor(max_workers=local_workers, thread_name_prefix='emotion-local')
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'hedges': 0, 'wins': {}, 'total_seconds': 0.0}
+
+    def _detect_with(self, backend, detect, text):
+        if self.cache is None:
+            return detect(text)
+        return self.cache.get_or_detect(backend, text, detect)
+
+    def _run_local(self, text):
+        return self._detect_with('local', self.text_analyzer.predict_mood, text)
+
+    def _run_gemini(self, text, hedge=False):
+        try:
+            return self._detect_with('gemini', self.hedge_detect if hedge else self.gemini_detect, text)
+        except Exception as e:
+            print(f"Error detecting emotion with Gemini: {e}")
+            return None, 0
+
+    def _usable(self, result):
+        return result is not None and result[0] and result[1] > self.min_gemini_confidence
+
+    def _record(self, winner, started):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['wins'][winner] = self._stats['wins'].get(winner, 0) + 1
+            self._stats['total_seconds'] += time.perf_counter() - started
+
+    def detect(self, text):
+        started = time.perf_counter()
+        deadline = started + self.budget
+        local_future = self.local_executor.submit(self._run_local, text)
+        gemini_futures = {self.executor.submit(self._run_gemini, text): 'gemini'}
+        hedge_at = started + self.hedge_after if self.hedge_after is not None else None
+        while gemini_futures:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if hedge_at is not None and now >= hedge_at:
+                gemini_futures[self.executor.submit(self._run_gemini, text, True)] = 'gemini_hedge'
+                hedge_at = None
+                with self._lock:
+                    self._stats['hedges'] += 1
+            wake_at = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, _ = wait(list(gemini_futures), timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                backend = gemini_futures.pop(future)
+                result = future.result()
+                if self._usable(result):
+                    self._record(backend, started)
+                    return result
+        # Gemini failed or missed the deadline: the deadline only applies to Gemini, so always wait
+        # for the local analyzer, which has been running alongside it
+        try:
+            result = local_future.result()
+            self._record('local', started)
+            return result
+        except Exception as e:
+            print(f"Error detecting emotion locally: {e}")
+        self._record('default', started)
+        return 'neutral', 0.5
+
+    def stats(self):
+        with self._lock:
+            stats = {**self._stats, 'wins': dict(self._stats['wins'])}
+        stats['avg_seconds'] = stats['total_seconds'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.local_executor.shutdown(wait=False)
@@ -0,0 +1,91 @@
+import json
+import re
+
+# Once preprocess_text strips everything but letters and whitespace, word_tokenize splits on
+# whitespace plus the few contractions below
+WORD_RE = re.compile(r"[a-z]+")
+NON_ALPHA_RE = re.compile(r"[^a-zA-Z\s]")
+
+# The Treebank word tokenizer splits these even without an apostrophe
+CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_RE.findall(NON_ALPHA_RE.sub('', text.lower())):
+        tokens.extend(CONTRACTIONS.get(word, (word,)))
+    return tokens
+
+
+class FastPreprocessor:
+    # NLTK-free stand-in for word_tokenize + stopwords + WordNetLemmatizer, driven by a table
+    # precomputed with NLTK; words outside the table's vocabulary come back unchanged
+    def __init__(self, stop_words, lemmas):
+        self.stop_words = frozenset(stop_words)
+        self.lemmas = dict(lemmas)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['stopwords'], data['lemmas'])
+
+    @classmethod
+    def build(cls, vocabulary, stop_words, lemmatize):
+        # Only words whose lemma differs are stored, which keeps the table small
+        lemmas = {}
+        for word in vocabulary:
+            lemma = lemmatize(word)
+            if lemma != word:
+                lemmas[word] = lemma
+        return cls(stop_words, lemmas)
+
+    def to_dict(self):
+        return {'stopwords': sorted(self.stop_words), 'lemmas': dict(sorted(self.lemmas.items()))}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    def tokenize(self, text):
+        return tokenize(text)
+
+    def lemmatize(self, token):
+        return self.lemmas.get(token, token)
+
+    def preprocess(self, text):
+        return [self.lemmatize(token) for token in self.tokenize(text) if token not in self.stop_words and len(token) > 2]
+
+
+def corpus_vocabulary(lines):
+    vocabulary = set()
+    for line in lines:
+        vocabulary.update(tokenize(line))
+    return vocabulary
+
+
+def verify_equivalence(reference, candidate, texts, max_examples=10):
+    # Compares two TextMoodAnalyzers text by text on both preprocessing and predicted mood
+    report = {'texts': 0, 'token_mismatches': 0, 'mood_mismatches': 0, 'examples': []}
+    for text in texts:
+        report['texts'] += 1
+        expected_tokens, actual_tokens = reference.preprocess_text(text), candidate.preprocess_text(text)
+        expected_mood, actual_mood = reference.predict_mood(text), candidate.predict_mood(text)
+        tokens_differ = expected_tokens != actual_tokens
+        moods_differ = expected_mood != actual_mood
+        report['token_mismatches'] += tokens_differ
+        report['mood_mismatches'] += moods_differ
+        if (tokens_differ or moods_differ) and len(report['examples']) < max_examples:
+            report['examples'].append({
+                'text': text,
+                'expected': {'tokens': expected_tokens, 'mood': expected_mood},
+                'actual': {'tokens': actual_tokens, 'mood': actual_mood}
+            })
+    return report
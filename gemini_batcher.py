@@ -0,0 +1,185 @@
+import json
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http_client import get_http_client
+from utils import EMOTION_OPTIONS, GEMINI_API_URL, normalize_gemini_emotion
+
+CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def build_batch_prompt(texts):
+    # The option list is sent once per batch instead of once per sentence
+    items = "\n".join(f"{i}. {json.dumps(text)}" for i, text in enumerate(texts, 1))
+    return (
+        f"Analyze the emotion in each numbered sentence below. For every sentence choose exactly one word "
+        f"from these options ({', '.join(EMOTION_OPTIONS)}).\n"
+        f"Return only a JSON array with one object per sentence, like "
+        f"[{{\"id\": 1, \"emotion\": \"happy\"}}].\n\n{items}"
+    )
+
+
+def parse_batch_response(text, count):
+    # Returns one raw label per item, None where the model's output was missing or malformed
+    labels = [None] * count
+    try:
+        data = json.loads(CODE_FENCE_RE.sub('', text.strip()))
+    except (ValueError, AttributeError):
+        return labels
+    if isinstance(data, dict):
+        data = [{'id': key, 'emotion': value} for key, value in data.items()]
+    if not isinstance(data, list):
+        return labels
+    for position, item in enumerate(data):
+        if isinstance(item, dict):
+            item_id, emotion = item.get('id', position + 1), item.get('emotion')
+        else:
+            item_id, emotion = position + 1, item
+        try:
+            index = int(item_id) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and isinstance(emotion, str) and emotion.strip():
+            labels[index] = emotion
+    return labels
+
+
+class GeminiBatcher:
+    def __init__(self, api_url=None, http_client=None, max_batch_size=16, max_wait=0.05, max_concurrent_batches=4,
+                 timeout=30.0):
+        self.api_url = api_url or GEMINI_API_URL
+        self.http = http_client or get_http_client()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix='gemini-batch')
+        self._lock = threading.Lock()
+        self._stats = {'items': 0, 'requests': 0, 'batches': 0, 'item_fallbacks': 0, 'failures': 0}
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, name='gemini-batch-collector', daemon=True)
+        self._collector.start()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _post(self, texts):
+        self._count('requests')
+        payload = {
+            "contents": [{"parts": [{"text": build_batch_prompt(texts)}]}],
+            "generationConfig": {"responseMimeType": "application/json"}
+        }
+        response = self.http.post(self.api_url, endpoint='gemini.generate', json=payload)
+        if response.status_code != 200:
+            print(f"Gemini API error: {response.status_code}")
+            return None
+        data = response.json()
+        return parse_batch_response(data["candidates"][0]["content"]["parts"][0]["text"], len(texts))
+
+    def _classify_batch(self, texts, retry_malformed=True):
+        if retry_malformed:
+            # Single-item retries of garbled answers are not batches of their own
+            self._count('batches')
+        self._count('items', len(texts))
+        try:
+            labels = self._post(texts)
+        except Exception as e:
+            print(f"Error calling Gemini API: {e}")
+            labels = None
+        if labels is None:
+            self._count('failures', len(texts))
+            return [(None, 0)] * len(texts)
+        results = []
+        for text, label in zip(texts, labels):
+            if label is not None:
+                results.append(normalize_gemini_emotion(label))
+            elif retry_malformed and len(texts) > 1:
+                # Only the items the model garbled are asked again, one by one
+                self._count('item_fallbacks')
+                results.append(self._classify_batch([text], retry_malformed=False)[0])
+            else:
+                self._count('failures')
+                results.append((None, 0))
+        return results
+
+    def classify_many(self, texts):
+        texts = list(texts)
+        results = []
+        for start in range(0, len(texts), self.max_batch_size):
+            results.extend(self._classify_batch(texts[start:start + self.max_batch_size]))
+        return results
+
+    def classify(self, text):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Gemini batcher has been closed")
+            self._queue.put((text, future))
+        # Bounded, so a caller can never hang on a batch that is lost
+        return future.result(self.timeout)
+
+    def _collect(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self._executor.submit(self._dispatch, batch)
+            except RuntimeError as e:
+                # The executor was shut down under us
+                self._fail(batch, e)
+
+    def _dispatch(self, batch):
+        try:
+            results = self._classify_batch([text for text, _ in batch])
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['items_per_request'] = stats['items'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        self._collector.join(timeout=1)
+        self._executor.shutdown(wait=False)
+        # Whatever the collector did not pick up will never be sent
+        pending = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        self._fail(pending, RuntimeError("Gemini batcher has been closed"))
@@ -0,0 +1,148 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from resilience import CircuitBreaker, FileTokenBucket, TokenBucket, UpstreamUnavailable
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# (connect, read) timeouts in seconds, keyed by logical endpoint name
+DEFAULT_TIMEOUTS = {
+    'default': (3.05, 10),
+    'jamendo.tracks': (3.05, 10),
+    'gemini.generate': (3.05, 10),
+}
+
+DEFAULT_HOST_POOL_SIZES = {
+    'api.jamendo.com': 32,
+    'generativelanguage.googleapis.com': 16,
+}
+
+# (requests per second, burst) allowed against each upstream from this host
+DEFAULT_RATE_LIMITS = {
+    'api.jamendo.com': (10, 20),
+    'generativelanguage.googleapis.com': (5, 10),
+}
+
+
+class HTTPClient:
+    def __init__(self, pool_connections=10, pool_maxsize=10, host_pool_sizes=None, timeouts=None,
+                 max_retries=3, backoff_factor=0.5, max_backoff=8.0, rate_limits=None, limiter_state_dir=None,
+                 limiter_timeout=1.0, breaker_threshold=5, breaker_reset_timeout=30.0):
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # Retries are handled in request() so urllib3 must not retry on its own
+        default_adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', default_adapter)
+        self.session.mount('http://', default_adapter)
+        pool_sizes = dict(DEFAULT_HOST_POOL_SIZES)
+        pool_sizes.update(host_pool_sizes or {})
+        for host, size in pool_sizes.items():
+            self.mount_host(host, size)
+        self.limiter_timeout = limiter_timeout
+        self.limiters = {}
+        self.breakers = {}
+        limits = dict(DEFAULT_RATE_LIMITS)
+        limits.update(rate_limits or {})
+        for host, (rate, burst) in limits.items():
+            if limiter_state_dir:
+                self.limiters[host] = FileTokenBucket(os.path.join(limiter_state_dir, f"{host}.bucket"), rate, burst)
+            else:
+                self.limiters[host] = TokenBucket(rate, burst)
+            self.breakers[host] = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+
+    def mount_host(self, host, pool_maxsize, scheme='https'):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount(f"{scheme}://{host}/", adapter)
+
+    def get_timeout(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeouts['default'])
+
+    def _backoff_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        # Full jitter keeps many sessions from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    def _admit(self, host):
+        breaker = self.breakers.get(host)
+        # Cheap early exit that does not claim a half-open probe slot
+        if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+            raise UpstreamUnavailable(f"Circuit open for {host}")
+        limiter = self.limiters.get(host)
+        if limiter is not None and not limiter.acquire(self.limiter_timeout):
+            raise UpstreamUnavailable(f"Rate limit exceeded for {host}")
+        # Asked last, so a probe the breaker lets through is always sent and then recorded
+        if breaker is not None and not breaker.allow():
+            raise UpstreamUnavailable(f"Circuit open for {host}")
+        return breaker
+
+    def request(self, method, url, endpoint='default', timeout=None, **kwargs):
+        timeout = timeout or self.get_timeout(endpoint)
+        host = urlsplit(url).hostname
+        attempt = 0
+        while True:
+            # Checked on every attempt so retries stop as soon as the breaker trips
+            breaker = self._admit(host)
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except Exception as e:
+                # Every outcome is recorded, or a half-open breaker would wait forever for its probe
+                if breaker is not None:
+                    breaker.record_failure()
+                # Read timeouts are not retried; the request may already be running upstream
+                if not isinstance(e, requests.exceptions.ConnectionError) or attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+            if breaker is not None:
+                if response.status_code in RETRY_STATUS_CODES:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def upstream_status(self):
+        return {host: breaker.stats() for host, breaker in self.breakers.items()}
+
+    def open_circuits(self):
+        return [host for host, breaker in self.breakers.items() if breaker.state == CircuitBreaker.OPEN]
+
+    def get(self, url, endpoint='default', **kwargs):
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint='default', **kwargs):
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client(**settings):
+    # Settings only apply when the shared client is first created
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HTTPClient(**settings)
+    return _client
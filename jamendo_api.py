@@ -1,34 +1,47 @@
+from collections import namedtuple
 import streamlit as st
 import requests
+from http_client import get_http_client
+from response_cache import make_key
+from singleflight import SingleFlight
 
 JAMENDO_CLIENT_ID = st.secrets["JAMENDO_CLIENT_ID"]
 
+# Everything needed to fetch (and cache) any page of one listing
+PageRequest = namedtuple('PageRequest', ['namespace', 'key_params', 'params', 'default_mood'])
+
+def _copy_tracks(tracks):
+    # Cached tracks are shared across sessions, so hand each caller its own dicts (and tag lists)
+    return [{key: list(value) if isinstance(value, list) else value for key, value in track.items()} for track in tracks]
+
+
 class JamendoAPI:
-    def __init__(self):
+    # Jamendo caps a single page at 200 results; larger limits are fetched as several pages
+    MAX_PAGE_SIZE = 200
+
+    def __init__(self, http_client=None, cache=None, singleflight=None):
+        self.http = http_client or get_http_client()
+        self.cache = cache
+        self.singleflight = singleflight or SingleFlight()
         self.client_id = JAMENDO_CLIENT_ID
         self.base_url = "https://api.jamendo.com/v3.0"
         self.tracks_endpoint = f"{self.base_url}/tracks/"
         self.albums_endpoint = f"{self.base_url}/albums/"
 
-    def fetch_tracks_by_mood(self, mood, limit=100):
+    def mood_request(self, mood):
+        mood = mood.strip().lower()
         params = {
             'client_id': self.client_id,
             'format': 'json',
-            'limit': limit,
             'fuzzytags': mood,
             'include': 'musicinfo',
             'audioformat': 'mp31'
         }
+        return PageRequest('mood', {'mood': mood}, params, mood)
+
+    def fetch_tracks_by_mood(self, mood, limit=100):
         try:
-            response = requests.get(self.tracks_endpoint, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            tracks = []
-            for track in data.get('results', []):
-                processed_track = self._process_track_data(track, mood)
-                if processed_track:
-                    tracks.append(processed_track)
-            return tracks
+            return self.fetch_pages(self.mood_request(mood), limit)
         except requests.exceptions.RequestException as e:
             print(f"API request error: {e}")
             return []
@@ -46,7 +59,7 @@ class JamendoAPI:
             'include': 'musicinfo'
         }
         try:
-            response = requests.get(self.tracks_endpoint, params=params, timeout=10)
+            response = self.http.get(self.tracks_endpoint, endpoint='jamendo.tracks', params=params)
             response.raise_for_status()
             data = response.json()
             if data.get('results'):
@@ -56,29 +69,84 @@ class JamendoAPI:
             print(f"Error getting track details: {e}")
             return None
 
-    def search_tracks(self, query, limit=20):
+    def search_request(self, query):
         params = {
             'client_id': self.client_id,
             'format': 'json',
-            'limit': limit,
             'search': query,
             'include': 'musicinfo',
             'audioformat': 'mp31'
         }
+        return PageRequest('search', {'search': query}, params, None)
+
+    def search_tracks(self, query, limit=20):
         try:
-            response = requests.get(self.tracks_endpoint, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            tracks = []
-            for track in data.get('results', []):
-                processed_track = self._process_track_data(track)
-                if processed_track:
-                    tracks.append(processed_track)
-            return tracks
+            return self.fetch_pages(self.search_request(query), limit)
         except requests.exceptions.RequestException as e:
             print(f"Search error: {e}")
             return []
 
+    def page_plan(self, limit):
+        return [(min(self.MAX_PAGE_SIZE, limit - offset), offset) for offset in range(0, limit, self.MAX_PAGE_SIZE)]
+
+    def fetch_page(self, request, limit, offset=0, cached=True):
+        params = {**request.params, 'limit': limit}
+        key_params = {**request.key_params, 'limit': limit}
+        if offset:
+            # Only later pages carry an offset, so first-page cache keys stay what they always were
+            params['offset'] = offset
+            key_params['offset'] = offset
+        if not cached:
+            return self._fetch_tracks(params, request.default_mood)
+        return self._cached_fetch(request.namespace, key_params, params, request.default_mood)
+
+    def fetch_pages(self, request, limit):
+        return self.merge_pages([self.fetch_page(request, page_limit, offset) for page_limit, offset in self.page_plan(limit)])
+
+    @staticmethod
+    def merge_pages(pages):
+        # The catalogue can shift between page requests, so the same track may show up twice
+        tracks = []
+        seen = set()
+        for page in pages:
+            for track in page:
+                if track['id'] in seen:
+                    continue
+                seen.add(track['id'])
+                tracks.append(track)
+        return tracks
+
+    def _fetch_tracks(self, params, default_mood=None):
+        response = self.http.get(self.tracks_endpoint, endpoint='jamendo.tracks', params=params)
+        response.raise_for_status()
+        data = response.json()
+        tracks = []
+        for track in data.get('results', []):
+            processed_track = self._process_track_data(track, default_mood)
+            if processed_track:
+                tracks.append(processed_track)
+        return tracks
+
+    def _cached_fetch(self, namespace, key_params, params, default_mood=None):
+        key_params = {'mood': None, 'limit': None, 'order': None, 'search': None, **key_params}
+        key = make_key(namespace, **key_params)
+
+        def load():
+            # Concurrent identical misses share a single upstream request
+            return self.singleflight.do(key, lambda: self._fetch_tracks(params, default_mood))
+
+        if self.cache is None:
+            return _copy_tracks(load())
+        try:
+            tracks = self.cache.get_or_load(namespace, key_params, load)
+        except requests.exceptions.RequestException as e:
+            # Jamendo is failing or its breaker is open: any cached copy, however old, beats nothing
+            tracks = self.cache.get_stale(namespace, key_params)
+            if tracks is None:
+                raise
+            print(f"Serving cached tracks while Jamendo is unavailable: {e}")
+        return _copy_tracks(tracks)
+
     def _process_track_data(self, track, default_mood=None):
         try:
             musicinfo = track.get('musicinfo', {})
@@ -138,25 +206,19 @@ class JamendoAPI:
                     return mood
         return 'neutral'
 
-    def get_popular_tracks(self, limit=50):
+    def popular_request(self):
         params = {
             'client_id': self.client_id,
             'format': 'json',
-            'limit': limit,
             'order': 'popularity_total',
             'include': 'musicinfo',
             'audioformat': 'mp31'
         }
+        return PageRequest('popular', {'order': 'popularity_total'}, params, None)
+
+    def get_popular_tracks(self, limit=50):
         try:
-            response = requests.get(self.tracks_endpoint, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            tracks = []
-            for track in data.get('results', []):
-                processed_track = self._process_track_data(track)
-                if processed_track:
-                    tracks.append(processed_track)
-            return tracks
+            return self.fetch_pages(self.popular_request(), limit)
         except requests.exceptions.RequestException as e:
             print(f"Error getting popular tracks: {e}")
-            return []
\ No newline at end of file
+            return []
@@ -0,0 +1,241 @@
+import argparse
+import json
+import subprocess
+import sys
+from text_analyzer import BatchStats, TextMoodAnalyzer, predict_moods
+from fast_preprocess import FastPreprocessor, corpus_vocabulary, verify_equivalence
+from catalog_ingest import CatalogIngester
+from recommendation_system import DEFAULT_RELATED_MOODS
+from services import build_registry
+from track_features import DEFAULT_MOODS
+
+
+def rebuild_preferences(registry, args):
+    registry.db_handler.flush()
+    count = registry.db_handler.rebuild_preference_vectors(args.user)
+    print(f"Rebuilt preference vectors for {count} user(s)")
+
+
+def migrate_likes(registry, args):
+    users, tracks = registry.db_handler.migrate_liked_tracks()
+    print(f"Moved {tracks} liked track(s) for {users} user(s) into the liked_tracks collection")
+
+
+def import_likes(registry, args):
+    # One JSON track per line, as exported from a playlist; ids alone are enough for --unlike
+    items = [json.loads(line) for line in _read_lines([args.input])]
+    if args.unlike:
+        track_ids = [item.get('id') or item.get('trackId') for item in items]
+        removed = registry.db_handler.bulk_unlike(args.user, track_ids, batch_size=args.batch_size)
+        print(f"Removed {removed} of {len(items)} liked track(s)")
+    else:
+        added = registry.db_handler.bulk_like(args.user, items, batch_size=args.batch_size)
+        print(f"Liked {added} new track(s) out of {len(items)}")
+
+
+def _default_catalog_moods():
+    moods = set(DEFAULT_MOODS)
+    for related in DEFAULT_RELATED_MOODS.values():
+        moods.update(related)
+    return sorted(moods)
+
+
+def ingest_catalog(registry, args):
+    ingester = CatalogIngester(registry.jamendo_api, registry.catalog_store, page_size=args.page_size)
+    moods = args.mood or _default_catalog_moods()
+    if args.reset:
+        for mood in moods:
+            ingester.reset(mood)
+    for result in ingester.ingest(moods, max_pages=args.max_pages):
+        if 'error' in result:
+            print(f"{result['mood']}: failed ({result['error']})")
+        else:
+            print(f"{result['mood']}: {result['fetched']} fetched, {result['added']} new, next offset {result['offset']}")
+    print(f"Catalog now holds {registry.catalog_store.count()} track(s)")
+
+
+def build_embeddings(registry, args):
+    index = registry.embedding_index
+    vectorizer = registry.track_vectorizer
+    batch, added = [], 0
+    for track in registry.catalog_store.iter_tracks(args.batch_size):
+        batch.append(track)
+        if len(batch) >= args.batch_size:
+            added += index.add([t['id'] for t in batch], vectorizer.vectorize_tracks(batch))
+            batch = []
+    if batch:
+        added += index.add([t['id'] for t in batch], vectorizer.vectorize_tracks(batch))
+    if args.train or index.centroids is None:
+        index.train(iterations=args.iterations)
+    index.snapshot()
+    print(f"Embedding index holds {len(index)} track(s), {added} new")
+
+
+def _read_lines(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.strip():
+                    yield line
+
+
+def build_lemma_table(registry, args):
+    reference = TextMoodAnalyzer(lexicon_path=args.lexicon)
+    lexicon = reference.lexicon
+    vocabulary = corpus_vocabulary(_read_lines(args.corpus))
+    # Keyword-stage tokens keep contractions glued together ("dont"), so cover those forms too
+    for line in _read_lines(args.corpus):
+        vocabulary.update(token for token in lexicon.tokenize(line) if token.isalpha())
+    for entries in lexicon.keywords.values():
+        for entry in entries:
+            vocabulary.update(lexicon.tokenize(entry['term'] if isinstance(entry, dict) else entry))
+    table = FastPreprocessor.build(sorted(vocabulary), reference.stop_words, reference.lemmatizer.lemmatize)
+    table.save(args.output)
+    print(f"Wrote {len(table.lemmas)} lemma(s) for a {len(vocabulary)}-word vocabulary to {args.output}")
+
+
+def verify_preprocess(registry, args):
+    reference = TextMoodAnalyzer(lexicon_path=args.lexicon)
+    candidate = TextMoodAnalyzer(lexicon_path=args.lexicon, preprocessor=FastPreprocessor.from_file(args.lemma_table))
+    report = verify_equivalence(reference, candidate, _read_lines(args.corpus), max_examples=args.show)
+    for example in report['examples']:
+        print(json.dumps(example))
+    print(f"{report['texts']} texts: {report['token_mismatches']} token mismatch(es), "
+          f"{report['mood_mismatches']} mood mismatch(es)")
+    if report['token_mismatches'] or report['mood_mismatches']:
+        sys.exit(1)
+
+
+def profile_imports(registry, args):
+    # A fresh interpreter per module, so nothing this process already imported skews the numbers
+    for module in args.module or ['app']:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+            capture_output=True, text=True
+        )
+        timings = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            own_us, cumulative_us, name = line[len('import time:'):].split('|')
+            timings.append((int(cumulative_us), int(own_us), name.rstrip()))
+        if not timings:
+            print(f"{module}: import failed\n{result.stderr.strip()}")
+            continue
+        total = max(cumulative for cumulative, _, _ in timings)
+        print(f"{module}: {total / 1e6:.3f}s")
+        for cumulative, own, name in sorted(timings, reverse=True)[:args.top]:
+            print(f"  {cumulative / 1e3:9.1f} ms cumulative  {own / 1e3:8.1f} ms self  {name}")
+
+
+def _gemini_moods(batcher, texts, chunk_size, stats):
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= chunk_size:
+            yield from batcher.classify_many(chunk)
+            stats.texts += len(chunk)
+            stats.chunks += 1
+            chunk = []
+    if chunk:
+        yield from batcher.classify_many(chunk)
+        stats.texts += len(chunk)
+        stats.chunks += 1
+
+
+def backfill_moods(registry, args):
+    stats = BatchStats()
+    with open(args.input, encoding='utf-8') as source, open(args.output, 'w', encoding='utf-8') as sink:
+        texts = (line.rstrip('\n') for line in source)
+        if args.backend == 'gemini':
+            results = _gemini_moods(registry.gemini_batcher, texts, args.chunk_size, stats)
+        else:
+            results = predict_moods(
+                texts,
+                processes=args.processes,
+                chunk_size=args.chunk_size,
+                skip_stages=args.skip,
+                lexicon_path=args.lexicon,
+                stats=stats,
+                report_every=args.report_every,
+                lemma_table_path=args.lemma_table
+            )
+        for mood, confidence in results:
+            sink.write(json.dumps({'mood': mood, 'confidence': confidence}) + '\n')
+    print(f"Backfilled moods: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the Emotion Music app")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = subparsers.add_parser('rebuild-preferences', help="Recompute per-(user, mood) preference vectors from liked tracks")
+    rebuild.add_argument('--user', help="Only rebuild this user id")
+    rebuild.set_defaults(handler=rebuild_preferences)
+
+    migrate = subparsers.add_parser('migrate-likes', help="Move embedded likedTracks arrays into the liked_tracks collection")
+    migrate.set_defaults(handler=migrate_likes)
+
+    likes = subparsers.add_parser('import-likes', help="Like (or unlike) a JSON-lines file of tracks for one user in bulk")
+    likes.add_argument('user')
+    likes.add_argument('input')
+    likes.add_argument('--unlike', action='store_true', help="Remove these tracks from the user's likes instead")
+    likes.add_argument('--batch-size', type=int, default=1000)
+    likes.set_defaults(handler=import_likes)
+
+    backfill = subparsers.add_parser('backfill-moods', help="Predict moods for a file of texts, one per line, into JSON lines")
+    backfill.add_argument('input')
+    backfill.add_argument('output')
+    backfill.add_argument('--processes', type=int)
+    backfill.add_argument('--chunk-size', type=int, default=256)
+    backfill.add_argument('--skip', action='append', default=[], choices=['keywords', 'vader', 'textblob'],
+                          help="Skip an analysis stage; may be repeated")
+    backfill.add_argument('--lexicon', help="Mood lexicon JSON file")
+    backfill.add_argument('--lemma-table', help="Use the NLTK-free fast preprocessing backend with this lemma table")
+    backfill.add_argument('--backend', choices=['local', 'gemini'], default='local',
+                          help="Label with the local analyzer or with batched Gemini requests")
+    backfill.add_argument('--report-every', type=float, default=10.0, help="Seconds between throughput reports")
+    backfill.set_defaults(handler=backfill_moods)
+
+    ingest = subparsers.add_parser('ingest-catalog', help="Crawl Jamendo mood listings into the local catalog mirror")
+    ingest.add_argument('--mood', action='append', help="Mood listing to crawl; may be repeated (default: all known moods)")
+    ingest.add_argument('--max-pages', type=int, help="Stop each mood after this many pages")
+    ingest.add_argument('--page-size', type=int, default=200)
+    ingest.add_argument('--reset', action='store_true', help="Ignore checkpoints and crawl from the start")
+    ingest.set_defaults(handler=ingest_catalog)
+
+    embeddings = subparsers.add_parser('build-embeddings', help="Add catalog tracks to the embedding index and snapshot it")
+    embeddings.add_argument('--batch-size', type=int, default=5000)
+    embeddings.add_argument('--train', action='store_true', help="Recluster the IVF lists even if the index is trained")
+    embeddings.add_argument('--iterations', type=int, default=10)
+    embeddings.set_defaults(handler=build_embeddings)
+
+    lemmas = subparsers.add_parser('build-lemma-table', help="Precompute the fast preprocessing backend's lemma table with NLTK")
+    lemmas.add_argument('output')
+    lemmas.add_argument('--corpus', action='append', default=[], help="Text file whose vocabulary to cover; may be repeated")
+    lemmas.add_argument('--lexicon', help="Mood lexicon JSON file")
+    lemmas.set_defaults(handler=build_lemma_table)
+
+    verify = subparsers.add_parser('verify-preprocess', help="Check the fast backend matches NLTK on a corpus, one text per line")
+    verify.add_argument('corpus', nargs='+')
+    verify.add_argument('--lemma-table', required=True)
+    verify.add_argument('--lexicon', help="Mood lexicon JSON file")
+    verify.add_argument('--show', type=int, default=10, help="Print up to this many mismatching texts")
+    verify.set_defaults(handler=verify_preprocess)
+
+    profile = subparsers.add_parser('profile-imports', help="Report import time per module, slowest first")
+    profile.add_argument('--module', action='append', help="Module to import; may be repeated (default: app)")
+    profile.add_argument('--top', type=int, default=20)
+    profile.set_defaults(handler=profile_imports)
+
+    args = parser.parse_args()
+    registry = build_registry()
+    try:
+        args.handler(registry, args)
+    finally:
+        registry.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import json
+import re
+
+DEFAULT_MOOD_KEYWORDS = {
+    'happy': ['happy', 'joy', 'excited', 'cheerful', 'glad', 'elated', 'euphoric', 'delighted', 'amazing', 'wonderful', 'great', 'fantastic', 'awesome',
+              {'term': 'over the moon', 'weight': 2}, {'term': 'on cloud nine', 'weight': 2}, {'term': 'in high spirits', 'weight': 2}],
+    'sad': ['sad', 'depressed', 'down', 'blue', 'melancholy', 'gloomy', 'sorrowful', 'heartbroken', 'crying', 'tears', 'lonely', 'empty',
+            {'term': 'down in the dumps', 'weight': 2}, {'term': 'broken heart', 'weight': 2}, {'term': 'feeling low', 'weight': 2}],
+    'angry': ['angry', 'mad', 'furious', 'rage', 'annoyed', 'irritated', 'frustrated', 'pissed', 'hate', 'livid', 'outraged',
+              {'term': 'fed up', 'weight': 2}, {'term': 'sick of', 'weight': 2}, {'term': 'pissed off', 'weight': 2}],
+    'fear': ['scared', 'afraid', 'terrified', 'anxious', 'worried', 'nervous', 'panic', 'frightened', 'fearful', 'apprehensive',
+             {'term': 'freaked out', 'weight': 2}, {'term': 'stressed out', 'weight': 2}],
+    'surprise': ['surprised', 'shocked', 'amazed', 'astonished', 'stunned', 'bewildered', 'confused', 'unexpected',
+                 {'term': 'blown away', 'weight': 2}, {'term': 'caught off guard', 'weight': 2}],
+    'neutral': ['okay', 'fine', 'normal', 'regular', 'usual', 'typical', 'average',
+                {'term': 'so so', 'weight': 2}],
+    'energetic': ['energetic', 'active', 'pumped', 'motivated', 'driven', 'dynamic', 'vigorous', 'lively',
+                  {'term': 'fired up', 'weight': 2}, {'term': 'pumped up', 'weight': 2}],
+    'calm': ['calm', 'peaceful', 'relaxed', 'serene', 'tranquil', 'quiet', 'restful', 'zen', 'meditative',
+             {'term': 'at peace', 'weight': 2}, {'term': 'chilled out', 'weight': 2}],
+}
+
+DEFAULT_NEGATORS = [
+    'not', 'no', 'never', 'nothing', 'hardly', 'barely', 'without', 'nor', 'neither',
+    'dont', 'doesnt', 'didnt', 'isnt', 'wasnt', 'arent', 'werent', 'cant', 'cannot', 'couldnt', 'wont', 'aint'
+]
+
+# Where a negated keyword points instead ("not happy" reads as sad); moods missing here are dropped when negated
+DEFAULT_NEGATED_MOODS = {
+    'happy': 'sad',
+    'sad': 'neutral',
+    'calm': 'fear',
+    'fear': 'calm',
+    'angry': 'calm',
+    'energetic': 'calm',
+}
+
+# An intensifier later in a negated clause turns it into praise ("never been so happy"), so it
+# ends the negation scope; right after the negator it is a hedge instead ("not so happy")
+DEFAULT_SCOPE_BREAKS = ['so', 'more', 'ever', 'such']
+
+TOKEN_RE = re.compile(r"[a-z]+(?:'[a-z]+)?|[.!?;,]")
+CLAUSE_BREAKS = {'.', '!', '?', ';', ','}
+
+
+class MoodLexicon:
+    def __init__(self, keywords=None, negators=None, negated_moods=None, negation_window=3, scope_breaks=None):
+        self.keywords = keywords or DEFAULT_MOOD_KEYWORDS
+        self.negators = set(negators if negators is not None else DEFAULT_NEGATORS)
+        self.negated_moods = negated_moods if negated_moods is not None else DEFAULT_NEGATED_MOODS
+        self.negation_window = negation_window
+        self.scope_breaks = set(scope_breaks if scope_breaks is not None else DEFAULT_SCOPE_BREAKS)
+        self.moods = list(self.keywords)
+        self.token_index = {}
+        self.phrase_index = {}
+        for mood, entries in self.keywords.items():
+            for entry in entries:
+                if isinstance(entry, dict):
+                    term, weight = entry['term'], float(entry.get('weight', 1))
+                else:
+                    term, weight = entry, 1.0
+                words = tuple(self.tokenize(term))
+                if len(words) == 1:
+                    self.token_index.setdefault(words[0], []).append((mood, weight))
+                elif words:
+                    self.phrase_index.setdefault(words[0], []).append((words, mood, weight))
+        for candidates in self.phrase_index.values():
+            # Longest phrase wins when several start with the same word
+            candidates.sort(key=lambda candidate: -len(candidate[0]))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(
+            keywords=data['keywords'],
+            negators=data.get('negators'),
+            negated_moods=data.get('negated_moods'),
+            negation_window=data.get('negation_window', 3),
+            scope_breaks=data.get('scope_breaks')
+        )
+
+    def to_dict(self):
+        return {
+            'keywords': self.keywords,
+            'negators': sorted(self.negators),
+            'negated_moods': self.negated_moods,
+            'negation_window': self.negation_window,
+            'scope_breaks': sorted(self.scope_breaks)
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def tokenize(self, text):
+        return [token.replace("'", '') for token in TOKEN_RE.findall(text.lower())]
+
+    def _match_phrase(self, tokens, i):
+        for words, mood, weight in self.phrase_index.get(tokens[i], ()):
+            if tuple(tokens[i:i + len(words)]) == words:
+                return len(words), [(mood, weight)]
+        return 0, None
+
+    def _comparative(self, token):
+        # "happier", "calmer", "sadder" -> the keyword they compare
+        if len(token) < 5 or not token.endswith('er'):
+            return None
+        stem = token[:-2]
+        candidates = [stem[:-1] + 'y'] if stem.endswith('i') else [stem, stem + 'e']
+        if len(stem) > 2 and stem[-1] == stem[-2]:
+            candidates.append(stem[:-1])
+        for candidate in candidates:
+            hits = self.token_index.get(candidate)
+            if hits:
+                return hits
+        return None
+
+    def score(self, tokens, lemmatize=None):
+        scores = {mood: 0.0 for mood in self.moods}
+        negated_until = -1
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token in CLAUSE_BREAKS:
+                negated_until = -1
+                i += 1
+                continue
+            if token in self.negators:
+                negated_until = i + self.negation_window
+                i += 1
+                continue
+            if token in self.scope_breaks and i <= negated_until and tokens[i - 1] not in self.negators:
+                negated_until = -1
+            length, hits = self._match_phrase(tokens, i)
+            comparative = False
+            if not hits:
+                length = 1
+                hits = self.token_index.get(token)
+                if hits is None and lemmatize is not None and len(token) > 2:
+                    hits = self.token_index.get(lemmatize(token))
+                if hits is None:
+                    hits = self._comparative(token)
+                    # "couldn't be happier" is as happy as it gets
+                    comparative = hits is not None
+            if hits:
+                negated = i <= negated_until and not comparative
+                for mood, weight in hits:
+                    if negated:
+                        mood = self.negated_moods.get(mood)
+                        if mood is None or mood not in scores:
+                            continue
+                    scores[mood] += weight
+            i += length
+        return scores
+
+    def best_mood(self, tokens, lemmatize=None):
+        scores = self.score(tokens, lemmatize)
+        best = max(scores, key=scores.get) if scores else None
+        if best is not None and scores[best] > 0:
+            return best
+        return None
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+# NLTK package name -> resource path that nltk.data.find resolves (zipped or unzipped)
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+    'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger',
+}
+
+_checked = False
+_lock = threading.Lock()
+
+
+def missing_nltk_resources():
+    # Only looks at the local NLTK data path; never touches the network
+    import nltk
+    missing = []
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+
+def download_nltk_resources(packages=None, download_dir=None):
+    import nltk
+    for package in packages or NLTK_RESOURCES:
+        nltk.download(package, download_dir=download_dir, quiet=True)
+
+
+def ensure_nltk_data(download=False):
+    # Checked once per process; images built with the prefetch step never download at runtime
+    global _checked
+    if _checked:
+        return []
+    with _lock:
+        if _checked:
+            return []
+        missing = missing_nltk_resources()
+        if missing and download:
+            download_nltk_resources(missing)
+            missing = missing_nltk_resources()
+        if missing:
+            print(f"Missing NLTK data: {', '.join(missing)}; run `python nlp_assets.py` to prefetch it")
+        _checked = True
+        return missing
+
+
+if __name__ == "__main__":
+    # Build-time prefetch: downloads into $NLTK_DATA (or NLTK's default) and fails the build if anything is missing
+    download_nltk_resources(download_dir=os.environ.get('NLTK_DATA'))
+    still_missing = missing_nltk_resources()
+    if still_missing:
+        print(f"Could not fetch NLTK data: {', '.join(still_missing)}")
+        sys.exit(1)
+    print("NLTK data ready")
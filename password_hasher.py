@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+
+# Raised when the hashing queue is full; callers should ask the user to retry shortly
+class HasherBusy(Exception):
+    pass
+
+
+# Raised when a queued password operation did not finish in time; also a "try again" condition
+class HasherTimeout(HasherBusy):
+    pass
+
+
+class PasswordHasher:
+    # bcrypt releases the GIL while hashing, so a few worker threads run hashes in parallel
+    # and the script threads of other sessions keep running while logins wait their turn
+    def __init__(self, rounds=12, max_workers=None, max_queue=64, timeout=30.0):
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._stats = {'hashes': 0, 'verifications': 0, 'rehashes': 0, 'rejected': 0, 'timeouts': 0, 'hash_seconds': 0.0,
+                       'max_hash_seconds': 0.0}
+
+    def _run(self, kind, fn, *args):
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._stats[kind] += 1
+                self._stats['hash_seconds'] += elapsed
+                self._stats['max_hash_seconds'] = max(self._stats['max_hash_seconds'], elapsed)
+
+    def _submit(self, kind, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise HasherBusy("Too many password operations in progress")
+            self._pending += 1
+        return self._executor.submit(self._run, kind, fn, *args)
+
+    def _hash(self, password):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+
+    def _verify(self, password, hashed):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+    def _wait(self, future):
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            # Still queued: drop it so it does not hash for a caller who has given up
+            cancelled = future.cancel()
+            with self._lock:
+                if cancelled:
+                    # _run never starts for it, so release its queue slot here
+                    self._pending -= 1
+                self._stats['timeouts'] += 1
+            raise HasherTimeout("Timed out waiting for a password worker")
+
+    def hash(self, password):
+        return self._wait(self._submit('hashes', self._hash, password))
+
+    def hash_async(self, password, kind='hashes'):
+        return self._submit(kind, self._hash, password)
+
+    def verify(self, password, hashed):
+        return self._wait(self._submit('verifications', self._verify, password, hashed))
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$<cost>$<salt+digest>
+        try:
+            return int(hashed.split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._running
+            stats['queue_depth'] = self._pending - self._running
+        operations = stats['hashes'] + stats['verifications'] + stats['rehashes']
+        stats['avg_hash_ms'] = 1000 * stats['hash_seconds'] / operations if operations else 0.0
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
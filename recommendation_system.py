@@ -1,80 +1,141 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from collections import Counter
+from track_features import TrackVectorizer
+
+# Neighbouring moods whose tracks also make good candidates
+DEFAULT_RELATED_MOODS = {
+    'happy': ['upbeat', 'energetic'],
+    'sad': ['melancholic', 'emotional'],
+    'angry': ['powerful', 'dark'],
+    'calm': ['relaxing', 'mellow'],
+    'energetic': ['upbeat', 'powerful'],
+    'romantic': ['love', 'soft'],
+    'melancholic': ['sad', 'emotional'],
+    'relaxing': ['calm', 'soft'],
+}
 
 class MusicRecommendationSystem:
-    def __init__(self, db_handler, jamendo_api):
+    def __init__(self, db_handler, jamendo_api, vectorizer=None, async_jamendo=None, related_moods=None,
+                 catalog=None, catalog_limit=5000, embedding_index=None):
         self.db = db_handler
+        self.embedding_index = embedding_index
         self.jamendo_api = jamendo_api
-        self.all_genres = [
-            'pop', 'rock', 'electronic', 'indie', 'trance', 'rap', 'hip-hop', 'metal', 
-            'jazz', 'ambient', 'classical', 'folk', 'reggae', 'funk', 'blues', 
-            'dance', 'country', 'alternative', 'punk', 'soul', 'r&b', 'Unknown'
-        ]
-        self.all_moods = [
-            'happy', 'sad', 'angry', 'calm', 'energetic', 'neutral', 
-            'surprise', 'romantic', 'melancholy', 'excited', 'peaceful'
-        ]
+        self.catalog = catalog
+        self.catalog_limit = catalog_limit
+        self.async_jamendo = async_jamendo
+        self.related_moods = related_moods if related_moods is not None else {}
+        self.vectorizer = vectorizer or TrackVectorizer()
+        self.all_genres = self.vectorizer.all_genres
+        self.all_moods = self.vectorizer.all_moods
 
     def vectorize_track(self, track):
-        try:
-            genre = track.get('genre', 'Unknown').lower()
-            genre_vector = [1 if genre == g.lower() else 0 for g in self.all_genres]
-            mood = track.get('mood', 'neutral').lower()
-            mood_vector = [1 if mood == m.lower() else 0 for m in self.all_moods]
-            artist = track.get('artist', 'Unknown').lower()
-            artist_hash = abs(hash(artist)) % 50
-            artist_vector = [1 if i == artist_hash else 0 for i in range(50)]
-            combined_vector = genre_vector + mood_vector + artist_vector
-            return np.array(combined_vector, dtype=np.float32)
-        except Exception as e:
-            print(f"Error vectorizing track: {e}")
-            return np.zeros(len(self.all_genres) + len(self.all_moods) + 50, dtype=np.float32)
+        return self.vectorizer.vectorize_track(track)
 
     def get_user_preference_vector(self, user_id, mood):
         try:
+            stored = self.db.get_preference_vector(user_id, mood)
+            if stored is not None:
+                sums, count = stored
+                if count <= 0:
+                    return None
+                return sums / np.float32(count)
             liked_tracks = self.db.get_user_liked_tracks(user_id, mood)
             if not liked_tracks:
                 return None
-            vectors = []
-            for track in liked_tracks:
-                vector = self.vectorize_track(track)
-                vectors.append(vector)
-            if not vectors:
-                return None
-            user_vector = np.mean(vectors, axis=0)
-            return user_vector
+            # Likes that predate the stored vectors: build this mood's vector once so later
+            # requests stay cheap. Queued behind pending like deltas so none is counted twice
+            self.db.schedule_preference_rebuild(user_id, mood=mood)
+            return np.mean(self.vectorize_tracks(liked_tracks), axis=0)
         except Exception as e:
             print(f"Error getting user preference vector: {e}")
             return None
 
+    def vectorize_tracks(self, tracks):
+        return self.vectorizer.vectorize_tracks(tracks)
+
+    def score_tracks(self, user_vector, tracks):
+        if not tracks:
+            return np.zeros(0, dtype=np.float32)
+        matrix = self.vectorize_tracks(tracks)
+        # Cosine similarity: normalize first and then take the dot products
+        norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+        norms[norms == 0] = 1
+        matrix /= norms[:, np.newaxis]
+        user_vector = np.asarray(user_vector, dtype=np.float32)
+        user_norm = np.sqrt(np.einsum('i,i->', user_vector, user_vector))
+        if user_norm == 0:
+            user_norm = 1
+        # A stacked matmul runs the same per-pair dot kernel as the old 1xN calls, so scores
+        # (and therefore tie order) match them bit for bit, in one call over all candidates
+        scores = np.matmul(matrix[:, np.newaxis, :], (user_vector / user_norm)[:, np.newaxis])
+        return scores.reshape(-1)
+
+    def _top_n_indices(self, scores, top_n):
+        if top_n <= 0 or len(scores) == 0:
+            return np.zeros(0, dtype=np.intp)
+        if top_n < len(scores):
+            threshold = scores[np.argpartition(-scores, top_n - 1)[:top_n]].min()
+            # Keep every candidate tied at the cut-off so the stable sort breaks ties by position
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            candidates = np.arange(len(scores))
+        order = np.argsort(-scores[candidates], kind='stable')
+        return candidates[order][:top_n]
+
+    def get_candidate_tracks(self, mood, limit=50):
+        moods = [mood] + list(self.related_moods.get(mood.strip().lower(), []))
+        if self.catalog is not None:
+            # The local mirror answers from thousands of tracks without a network round trip
+            tracks = self.catalog.query(moods=moods, limit=self.catalog_limit)
+            if tracks:
+                return tracks
+        if len(moods) == 1:
+            return self.jamendo_api.fetch_tracks_by_mood(mood, limit=limit)
+        if self.async_jamendo is not None:
+            # All moods' pages go out concurrently instead of one round trip after another
+            pools = list(self.async_jamendo.fetch_tracks_for_moods_sync(moods, limit=limit).values())
+        else:
+            pools = [self.jamendo_api.fetch_tracks_by_mood(m, limit=limit) for m in moods]
+        return self.jamendo_api.merge_pages(pools)
+
+    def _indexed_recommendations(self, user_vector, mood, liked_track_ids, top_n):
+        self.embedding_index.refresh()
+        if not len(self.embedding_index):
+            return None
+        # Only tracks listed under the requested (or a related) mood qualify
+        listings = self.catalog.mood_listings([mood] + list(self.related_moods.get(mood.strip().lower(), [])))
+        hits = self.embedding_index.search(
+            user_vector, top_n, exclude_ids={str(i) for i in liked_track_ids}, include_ids=listings
+        )
+        tracks = {str(track['id']): track for track in self.catalog.get_tracks([track_id for track_id, _ in hits])}
+        return [
+            {'track': dict(tracks[track_id], mood=listings[track_id]), 'similarity': score}
+            for track_id, score in hits if track_id in tracks
+        ]
+
     def get_recommendations(self, user_id, mood, top_n=10):
         try:
             user_vector = self.get_user_preference_vector(user_id, mood)
             if user_vector is None:
                 print(f"No user preferences found for mood: {mood}")
                 return []
-            candidate_tracks = self.jamendo_api.fetch_tracks_by_mood(mood, limit=50)
+            if self.embedding_index is not None and self.catalog is not None:
+                recommendations = self._indexed_recommendations(
+                    user_vector, mood, self.db.get_liked_track_ids(user_id), top_n
+                )
+                if recommendations:
+                    print(f"Generated {len(recommendations)} recommendations for mood: {mood}")
+                    return recommendations
+            candidate_tracks = self.get_candidate_tracks(mood, limit=50)
             if not candidate_tracks:
                 print("No candidate tracks found")
                 return []
-            liked_tracks = self.db.get_user_liked_tracks(user_id)
-            liked_track_ids = set(track.get('trackId') for track in liked_tracks)
-            similarities = []
-            for track in candidate_tracks:
-                if track['id'] in liked_track_ids:
-                    continue
-                track_vector = self.vectorize_track(track)
-                similarity = cosine_similarity(
-                    user_vector.reshape(1, -1),
-                    track_vector.reshape(1, -1)
-                )[0][0]
-                similarities.append({
-                    'track': track,
-                    'similarity': float(similarity)
-                })
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-            recommendations = similarities[:top_n]
+            liked_track_ids = self.db.get_liked_track_ids(user_id)
+            candidate_tracks = [track for track in candidate_tracks if track['id'] not in liked_track_ids]
+            scores = self.score_tracks(user_vector, candidate_tracks)
+            recommendations = [
+                {'track': candidate_tracks[i], 'similarity': float(scores[i])}
+                for i in self._top_n_indices(scores, top_n)
+            ]
             print(f"Generated {len(recommendations)} recommendations for mood: {mood}")
             return recommendations
         except Exception as e:
@@ -105,22 +166,16 @@ class MusicRecommendationSystem:
 
     def get_user_music_insights(self, user_id):
         try:
-            liked_tracks = self.db.get_user_liked_tracks(user_id)
-            if not liked_tracks:
+            stats = self.db.get_user_stats(user_id)
+            if not stats.get('total_tracks'):
                 return {}
-            moods = [track.get('mood', 'unknown') for track in liked_tracks]
-            genres = [track.get('genre', 'Unknown') for track in liked_tracks]
-            artists = [track.get('artist', 'Unknown') for track in liked_tracks]
-            mood_counts = Counter(moods)
-            genre_counts = Counter(genres)
-            artist_counts = Counter(artists)
             return {
-                'total_tracks': len(liked_tracks),
-                'favorite_moods': dict(mood_counts.most_common(5)),
-                'favorite_genres': dict(genre_counts.most_common(5)),
-                'favorite_artists': dict(artist_counts.most_common(5)),
-                'mood_diversity': len(mood_counts),
-                'genre_diversity': len(genre_counts)
+                'total_tracks': stats['total_tracks'],
+                'favorite_moods': stats['favorite_moods'],
+                'favorite_genres': stats['favorite_genres'],
+                'favorite_artists': stats['favorite_artists'],
+                'mood_diversity': stats['mood_diversity'],
+                'genre_diversity': stats['genre_diversity']
             }
         except Exception as e:
             print(f"Error getting user insights: {e}")
@@ -0,0 +1,220 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_key(namespace, **params):
+    normalized = {}
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = ' '.join(value.lower().split())
+        normalized[name] = value
+    return f"{namespace}:{json.dumps(normalized, sort_keys=True)}"
+
+
+class LRUCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        # Unlike get(), a membership check leaves the recency order alone
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)')
+            self.conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT value, stored_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), stored_at)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune()
+            self.conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self.conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self.conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM cache')
+            self.conn.commit()
+
+    def _prune(self):
+        self.conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class TieredCache:
+    def __init__(self, memory=None, disk=None, ttl=600, stale_ttl=3600, ttls=None, refresh_workers=2):
+        self.memory = memory or LRUCache()
+        self.disk = disk
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.ttls = ttls or {}
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='cache-refresh')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._stats[name] += 1
+
+    def _lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry, 'memory_hits'
+        if self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except Exception as e:
+                print(f"Error reading disk cache: {e}")
+                entry = None
+            if entry is not None:
+                self.memory.set(key, *entry)
+                return entry, 'disk_hits'
+        return None, None
+
+    def _store(self, key, value):
+        stored_at = time.time()
+        self.memory.set(key, value, stored_at)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, stored_at)
+            except Exception as e:
+                print(f"Error writing disk cache: {e}")
+
+    def _schedule_refresh(self, key, loader, should_cache):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats['refreshes'] += 1
+        self._refresh_executor.submit(self._refresh, key, loader, should_cache)
+
+    def _refresh(self, key, loader, should_cache):
+        try:
+            value = loader()
+            if should_cache is None or should_cache(value):
+                self._store(key, value)
+        except Exception as e:
+            self._count('refresh_errors')
+            print(f"Error refreshing cache entry {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_load(self, namespace, key_params, loader, should_cache=None):
+        key = make_key(namespace, **key_params)
+        ttl = self.ttls.get(namespace, self.ttl)
+        entry, tier = self._lookup(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < ttl:
+                self._count('hits', tier)
+                return value
+            if age < ttl + self.stale_ttl:
+                # Serve the stale value now and let a background worker fetch a fresh one
+                self._count('stale_hits', tier)
+                self._schedule_refresh(key, loader, should_cache)
+                return value
+        self._count('misses')
+        value = loader()
+        if should_cache is None or should_cache(value):
+            self._store(key, value)
+        return value
+
+    def get_stale(self, namespace, key_params):
+        entry, _ = self._lookup(make_key(namespace, **key_params))
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, namespace, key_params):
+        key = make_key(namespace, **key_params)
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        return stats
+
+    def close(self):
+        self._refresh_executor.shutdown(wait=False)
+        if self.disk is not None:
+            self.disk.close()
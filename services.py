@@ -0,0 +1,379 @@
+import atexit
+import os
+import threading
+import streamlit as st
+from http_client import get_http_client
+from response_cache import LRUCache, SQLiteCache, TieredCache
+from emotion_cache import DetectionCache
+from emotion_detection import EmotionDetector
+from gemini_batcher import GeminiBatcher
+from utils import call_gemini_emotion_api, request_gemini_emotion
+from db_handler import MongoDBHandler
+from text_analyzer import TextMoodAnalyzer
+from jamendo_api import JamendoAPI
+from async_jamendo_api import AsyncJamendoAPI
+from recommendation_system import DEFAULT_RELATED_MOODS, MusicRecommendationSystem
+from track_features import TrackVectorizer
+from catalog_store import CatalogStore
+from embedding_index import EmbeddingIndex
+from user_auth import UserAuth
+from session_manager import SessionManager
+from nlp_assets import ensure_nltk_data
+from fast_preprocess import FastPreprocessor
+from password_hasher import PasswordHasher
+
+
+# What the Streamlit app uses directly; optional services (catalog mirror, embedding index,
+# Gemini batcher) are only built once something configured to use them asks for them
+APP_SERVICES = [
+    'db_handler', 'text_analyzer', 'jamendo_api', 'rec_system', 'user_auth', 'emotion_detector', 'session_manager'
+]
+
+
+class ServiceRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._factories = {}
+        self._warm_up_hooks = {}
+        self._health_checks = {}
+        self._shutdown_hooks = {}
+        self._instances = {}
+        self._creation_order = []
+        self._closed = False
+
+    def register(self, name, factory, warm_up=None, health_check=None, shutdown=None):
+        with self._lock:
+            self._factories[name] = factory
+            if warm_up:
+                self._warm_up_hooks[name] = warm_up
+            if health_check:
+                self._health_checks[name] = health_check
+            if shutdown:
+                self._shutdown_hooks[name] = shutdown
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Service registry has been shut down")
+            instance = self._instances.get(name)
+            if instance is None:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service: {name}")
+                # Factories receive the registry so they can resolve their own dependencies
+                instance = self._factories[name](self)
+                self._instances[name] = instance
+                self._creation_order.append(name)
+            return instance
+
+    def warm_up(self, names=None):
+        for name in names or list(self._factories):
+            # One failing service (e.g. MongoDB unreachable) must not stop the others warming up
+            try:
+                instance = self.get(name)
+                hook = self._warm_up_hooks.get(name)
+                if hook:
+                    hook(instance)
+            except Exception as e:
+                print(f"Error warming up {name}: {e}")
+
+    def health_check(self):
+        status = {}
+        for name in self._factories:
+            if name not in self._instances:
+                status[name] = 'not started'
+                continue
+            check = self._health_checks.get(name)
+            if not check:
+                status[name] = 'ok'
+                continue
+            try:
+                status[name] = 'ok' if check(self._instances[name]) else 'unhealthy'
+            except Exception as e:
+                status[name] = f"error: {e}"
+        return status
+
+    def shutdown(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for name in reversed(self._creation_order):
+                hook = self._shutdown_hooks.get(name)
+                if hook:
+                    try:
+                        hook(self._instances[name])
+                    except Exception as e:
+                        print(f"Error shutting down {name}: {e}")
+            self._instances.clear()
+            self._creation_order.clear()
+
+    @property
+    def http_client(self):
+        return self.get('http_client')
+
+    @property
+    def password_hasher(self):
+        return self.get('password_hasher')
+
+    @property
+    def db_handler(self):
+        return self.get('db_handler')
+
+    @property
+    def text_analyzer(self):
+        return self.get('text_analyzer')
+
+    @property
+    def jamendo_cache(self):
+        return self.get('jamendo_cache')
+
+    @property
+    def jamendo_api(self):
+        return self.get('jamendo_api')
+
+    @property
+    def async_jamendo_api(self):
+        return self.get('async_jamendo_api')
+
+    @property
+    def track_vectorizer(self):
+        return self.get('track_vectorizer')
+
+    @property
+    def catalog_store(self):
+        return self.get('catalog_store')
+
+    @property
+    def embedding_index(self):
+        return self.get('embedding_index')
+
+    @property
+    def rec_system(self):
+        return self.get('rec_system')
+
+    @property
+    def detection_cache(self):
+        return self.get('detection_cache')
+
+    @property
+    def gemini_batcher(self):
+        return self.get('gemini_batcher')
+
+    @property
+    def emotion_detector(self):
+        return self.get('emotion_detector')
+
+    @property
+    def user_auth(self):
+        return self.get('user_auth')
+
+    @property
+    def session_manager(self):
+        return self.get('session_manager')
+
+
+def _config(name, default=None):
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+
+def _config_bool(name, default=False):
+    # Secrets may hold real booleans or strings such as "false"; bool("false") would be True
+    value = _config(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
+
+def _build_preprocessor():
+    if _config('PREPROCESS_BACKEND', 'nltk') != 'fast':
+        return None
+    path = _config('LEMMA_TABLE_PATH', 'lemma_table.json')
+    if not os.path.exists(path):
+        # The table is generated at image build time; without it NLTK still gives the same results
+        print(f"Lemma table {path} not found; falling back to the NLTK preprocessing backend")
+        return None
+    return FastPreprocessor.from_file(path)
+
+
+def _warm_up_text_analyzer(analyzer):
+    if analyzer.preprocessor is None:
+        # The fast backend needs no NLTK data at all
+        ensure_nltk_data(download=_config_bool('NLTK_AUTO_DOWNLOAD', True))
+    # Forces the lazily imported NLP libraries and corpora to load before sessions need them
+    analyzer.predict_mood("warming up the analyzer")
+
+
+def _optional_float(value):
+    return float(value) if value is not None else None
+
+
+def _gemini_detect(registry):
+    # Opt-in: a batched prompt mixes different users' free text, so one user's text could try to
+    # steer how another's is classified
+    if not _config_bool('GEMINI_BATCHING', False):
+        return call_gemini_emotion_api
+    # Texts from concurrent sessions arriving within the batch window share one Gemini request
+    return lambda text: call_gemini_emotion_api(text, registry.gemini_batcher.classify)
+
+
+def _related_moods():
+    # Opt-in: a table of mood -> related moods, or true for the built-in table
+    related = _config('RECOMMENDATION_RELATED_MOODS')
+    if isinstance(related, (bool, str)):
+        return DEFAULT_RELATED_MOODS if _config_bool('RECOMMENDATION_RELATED_MOODS') else {}
+    return dict(related or {})
+
+
+def _build_jamendo_cache(registry):
+    disk_path = _config('JAMENDO_CACHE_PATH')
+    return TieredCache(
+        memory=LRUCache(max_entries=int(_config('JAMENDO_CACHE_MAX_ENTRIES', 512))),
+        disk=SQLiteCache(disk_path) if disk_path else None,
+        ttl=float(_config('JAMENDO_CACHE_TTL', 600)),
+        stale_ttl=float(_config('JAMENDO_CACHE_STALE_TTL', 3600)),
+        ttls={'popular': float(_config('JAMENDO_POPULAR_CACHE_TTL', 3600))}
+    )
+
+
+def _build_session_manager(registry):
+    manager = SessionManager(
+        registry.user_auth,
+        secret=_config('SESSION_SECRET'),
+        ttl=float(_config('SESSION_TTL_SECONDS', 7 * 86400)),
+        max_sessions=int(_config('SESSION_CACHE_MAX_ENTRIES', 10000)),
+        persist=_config_bool('SESSION_PERSIST', True),
+        profile_max_age=float(_config('SESSION_PROFILE_MAX_AGE_SECONDS', 300)),
+        token_in_url=_config_bool('SESSION_TOKEN_IN_URL', False)
+    )
+    # Every like-count change made through this process patches the cached profiles
+    registry.db_handler.add_likes_listener(manager.adjust_liked_count)
+    return manager
+
+
+def build_registry():
+    registry = ServiceRegistry()
+    registry.register(
+        'http_client',
+        lambda r: get_http_client(
+            limiter_state_dir=_config('RATE_LIMIT_STATE_DIR'),
+            breaker_threshold=int(_config('CIRCUIT_BREAKER_THRESHOLD', 5)),
+            breaker_reset_timeout=float(_config('CIRCUIT_BREAKER_RESET_SECONDS', 30.0))
+        ),
+        # Unhealthy while any upstream's breaker is open
+        health_check=lambda client: not client.open_circuits(),
+        shutdown=lambda client: client.close()
+    )
+    registry.register(
+        'password_hasher',
+        lambda r: PasswordHasher(
+            rounds=int(_config('BCRYPT_ROUNDS', 12)),
+            max_workers=int(_config('PASSWORD_HASH_WORKERS', 0)) or None,
+            max_queue=int(_config('PASSWORD_HASH_QUEUE', 64))
+        ),
+        shutdown=lambda hasher: hasher.close()
+    )
+    registry.register(
+        'db_handler',
+        lambda r: MongoDBHandler(r.track_vectorizer, password_hasher=r.password_hasher),
+        health_check=lambda db: db.ping(),
+        shutdown=lambda db: db.close()
+    )
+    registry.register(
+        'text_analyzer',
+        lambda r: TextMoodAnalyzer(lexicon_path=_config('MOOD_LEXICON_PATH'), preprocessor=_build_preprocessor()),
+        warm_up=_warm_up_text_analyzer,
+        health_check=lambda analyzer: analyzer.predict_mood("ok")[0] is not None
+    )
+    registry.register('jamendo_cache', _build_jamendo_cache, shutdown=lambda cache: cache.close())
+    registry.register('jamendo_api', lambda r: JamendoAPI(r.http_client, r.jamendo_cache))
+    registry.register(
+        'async_jamendo_api',
+        lambda r: AsyncJamendoAPI(r.jamendo_api, max_concurrency=int(_config('JAMENDO_MAX_CONCURRENCY', 8)))
+    )
+    registry.register(
+        'track_vectorizer',
+        lambda r: TrackVectorizer(
+            artist_buckets=int(_config('TRACK_ARTIST_BUCKETS', 50)),
+            signed_hashing=_config_bool('TRACK_SIGNED_HASHING', False)
+        )
+    )
+    registry.register(
+        'catalog_store',
+        lambda r: CatalogStore(_config('CATALOG_PATH', 'catalog.db')),
+        shutdown=lambda store: store.close()
+    )
+    registry.register(
+        'embedding_index',
+        lambda r: EmbeddingIndex(
+            _config('EMBEDDING_INDEX_PATH', 'embeddings'),
+            r.track_vectorizer.vector_size,
+            schema_id=r.track_vectorizer.schema_id,
+            n_lists=int(_config('EMBEDDING_INDEX_LISTS', 64)),
+            nprobe=int(_config('EMBEDDING_INDEX_NPROBE', 8))
+        ),
+        shutdown=lambda index: index.close()
+    )
+    registry.register(
+        'rec_system',
+        lambda r: MusicRecommendationSystem(
+            r.db_handler,
+            r.jamendo_api,
+            r.track_vectorizer,
+            async_jamendo=r.async_jamendo_api,
+            related_moods=_related_moods(),
+            # Only recommend from the mirror once one has been configured (and ingested)
+            catalog=r.catalog_store if _config('CATALOG_PATH') else None,
+            catalog_limit=int(_config('CATALOG_CANDIDATE_LIMIT', 5000)),
+            embedding_index=r.embedding_index if _config('EMBEDDING_INDEX_PATH') else None
+        )
+    )
+    registry.register(
+        'detection_cache',
+        lambda r: DetectionCache(
+            max_entries=int(_config('DETECTION_CACHE_MAX_ENTRIES', 10000)),
+            ttl=float(_config('DETECTION_CACHE_TTL', 86400)),
+            path=_config('DETECTION_CACHE_PATH')
+        ),
+        shutdown=lambda cache: cache.close()
+    )
+    registry.register(
+        'gemini_batcher',
+        lambda r: GeminiBatcher(
+            http_client=r.http_client,
+            max_batch_size=int(_config('GEMINI_BATCH_MAX_SIZE', 16)),
+            max_wait=float(_config('GEMINI_BATCH_WINDOW_SECONDS', 0.05)),
+            timeout=float(_config('GEMINI_BATCH_TIMEOUT_SECONDS', 30.0))
+        ),
+        shutdown=lambda batcher: batcher.close()
+    )
+    registry.register(
+        'emotion_detector',
+        lambda r: EmotionDetector(
+            r.text_analyzer,
+            _gemini_detect(r),
+            hedge_detect=request_gemini_emotion,
+            cache=r.detection_cache,
+            budget=float(_config('DETECTION_BUDGET_SECONDS', 3.0)),
+            hedge_after=_optional_float(_config('DETECTION_HEDGE_AFTER_SECONDS'))
+        ),
+        shutdown=lambda detector: detector.close()
+    )
+    registry.register('user_auth', lambda r: UserAuth(r.db_handler))
+    registry.register('session_manager', _build_session_manager)
+    return registry
+
+
+@st.cache_resource(show_spinner=False)
+def get_services():
+    registry = build_registry()
+    # Warm-up loads NLP models and opens connections; doing it in the background lets the
+    # login page render while it runs, and anything a session needs first is built on demand
+    threading.Thread(target=registry.warm_up, args=(APP_SERVICES,), name='service-warm-up', daemon=True).start()
+    atexit.register(registry.shutdown)
+    return registry
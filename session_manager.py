@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from response_cache import LRUCache
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionUnavailable(Exception):
+    # The session could not be checked (e.g. MongoDB is down) and there is no cached profile to serve
+    pass
+
+
+class SessionManager:
+    # Tokens are "<payload>.<hmac>" so they can be checked without a lookup; the lean profile
+    # behind each session lives in an in-process cache, so steady-state reruns never hit MongoDB
+    def __init__(self, user_auth, secret=None, ttl=7 * 86400, max_sessions=10000, persist=True,
+                 profile_max_age=300, token_in_url=False):
+        self.user_auth = user_auth
+        self.db = user_auth.db
+        if not secret:
+            # Without a configured secret, tokens only stay valid for this process's lifetime
+            print("SESSION_SECRET is not set; sessions will not survive a restart")
+            secret = secrets.token_bytes(32)
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.persist = persist
+        # Other processes (maintenance commands, other replicas) change likes and profiles too,
+        # so a cached profile is reloaded once it is this old
+        self.profile_max_age = profile_max_age
+        # Off by default: a token in the URL leaks through history, shared links, referers and logs
+        self.token_in_url = token_in_url
+        self._profiles = LRUCache(max_entries=max_sessions)
+        self._user_sessions = {}
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def _decode(self, token):
+        try:
+            payload, signature = token.split('.')
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, AttributeError):
+            return None
+        if claims.get('exp', 0) < time.time():
+            return None
+        return claims
+
+    def _remember(self, session_id, profile):
+        self._profiles.set(session_id, profile, time.time())
+        with self._lock:
+            session_ids = self._user_sessions.setdefault(profile['id'], set())
+            # Forget sessions the LRU has already evicted
+            session_ids.intersection_update([sid for sid in session_ids if sid in self._profiles])
+            session_ids.add(session_id)
+
+    def create_session(self, user):
+        # user is the lean profile document returned by authenticate_user
+        profile = self.user_auth.build_profile(user)
+        session_id = secrets.token_urlsafe(16)
+        expires = time.time() + self.ttl
+        if self.persist:
+            self.db.create_session(session_id, profile['id'], datetime.now() + timedelta(seconds=self.ttl))
+        self._remember(session_id, profile)
+        payload = _b64encode(json.dumps({'sid': session_id, 'uid': profile['id'], 'exp': int(expires)}).encode('utf-8'))
+        return f"{payload}.{self._sign(payload)}"
+
+    def get_profile(self, token):
+        claims = self._decode(token) if token else None
+        if claims is None:
+            return None
+        entry = self._profiles.get(claims['sid'])
+        if entry is not None and time.time() - entry[1] < self.profile_max_age:
+            return entry[0]
+        try:
+            profile = self._load_profile(claims)
+        except Exception as e:
+            # A failed lookup says nothing about the session, so it must not log the user out
+            if entry is None:
+                raise SessionUnavailable(str(e)) from e
+            print(f"Error reloading session profile, serving the cached one: {e}")
+            # Re-stamped so an outage costs one failed lookup per profile_max_age, not one per rerun
+            self._profiles.set(claims['sid'], entry[0], time.time())
+            return entry[0]
+        if profile is None:
+            return None
+        self._remember(claims['sid'], profile)
+        return profile
+
+    def _load_profile(self, claims):
+        # Cold cache (restart, eviction, another server): the token alone is not enough once
+        # persisted, since logout deletes the session document
+        if self.persist and self.db.get_session(claims['sid']) is None:
+            return None
+        return self.user_auth.get_user_profile(claims['uid'])
+
+    def revoke(self, token):
+        claims = self._decode(token) if token else None
+        if claims is None:
+            return
+        self._profiles.delete(claims['sid'])
+        with self._lock:
+            self._user_sessions.get(claims['uid'], set()).discard(claims['sid'])
+        if self.persist:
+            self.db.delete_session(claims['sid'])
+
+    def invalidate_user(self, user_id):
+        # After a profile change: every session of the user reloads its profile on next use
+        with self._lock:
+            session_ids = self._user_sessions.pop(str(user_id), set())
+        for session_id in session_ids:
+            self._profiles.delete(session_id)
+
+    def adjust_liked_count(self, user_id, delta):
+        # Likes are frequent, so patch cached profiles in place instead of reloading them
+        with self._lock:
+            session_ids = list(self._user_sessions.get(str(user_id), ()))
+        for session_id in session_ids:
+            entry = self._profiles.get(session_id)
+            if entry is not None:
+                profile = dict(entry[0])
+                profile['liked_tracks_count'] = max(0, profile['liked_tracks_count'] + delta)
+                self._profiles.set(session_id, profile, entry[1])
+
+    def stats(self):
+        with self._lock:
+            users = len(self._user_sessions)
+        return {'cached_sessions': len(self._profiles), 'users': users}
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from fast_preprocess import FastPreprocessor, corpus_vocabulary, tokenize, verify_equivalence
+from nlp_assets import missing_nltk_resources
+from text_analyzer import TextMoodAnalyzer
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'preprocess_corpus.txt')
+
+
+def test_tokenize_splits_treebank_contractions():
+    assert tokenize("I cannot, I gotta go!") == ['i', 'can', 'not', 'i', 'got', 'ta', 'go']
+
+
+def test_words_outside_the_table_are_unchanged():
+    preprocessor = FastPreprocessor(['the'], {'songs': 'song'})
+    assert preprocessor.preprocess("The songs and melodies") == ['song', 'and', 'melodies']
+
+
+@pytest.mark.skipif(bool(missing_nltk_resources()), reason="NLTK data is not installed")
+def test_table_built_from_corpus_matches_nltk():
+    with open(CORPUS, encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    reference = TextMoodAnalyzer()
+    vocabulary = corpus_vocabulary(texts)
+    for text in texts:
+        vocabulary.update(token for token in reference.lexicon.tokenize(text) if token.isalpha())
+    table = FastPreprocessor.build(sorted(vocabulary), reference.stop_words, reference.lemmatizer.lemmatize)
+    report = verify_equivalence(reference, TextMoodAnalyzer(preprocessor=table), texts)
+    assert report['token_mismatches'] == 0 and report['mood_mismatches'] == 0, report['examples']
@@ -0,0 +1,33 @@
+import pytest
+
+from mood_lexicon import MoodLexicon
+
+
+@pytest.fixture(scope='module')
+def lexicon():
+    return MoodLexicon()
+
+
+@pytest.mark.parametrize('text, mood', [
+    ("I'm not happy", 'sad'),
+    ("I have not been happy lately", 'sad'),
+    ("I'm not so happy today", 'sad'),
+    ("not too happy about it", 'sad'),
+    ("I have never been so happy", 'happy'),
+    ("never been more excited in my life", 'happy'),
+    ("I couldn't be happier", 'happy'),
+    ("I've never felt calmer", 'calm'),
+])
+def test_negation_scope(lexicon, text, mood):
+    assert lexicon.best_mood(lexicon.tokenize(text)) == mood
+
+
+def test_comparatives_match_their_keyword(lexicon):
+    scores = lexicon.score(lexicon.tokenize("sadder and happier"))
+    assert scores['sad'] == 1 and scores['happy'] == 1
+
+
+def test_scope_breaks_round_trip(tmp_path, lexicon):
+    path = tmp_path / 'lexicon.json'
+    MoodLexicon(scope_breaks=['so']).save(path)
+    assert MoodLexicon.from_file(path).scope_breaks == {'so'}
@@ -1,27 +1,120 @@
 import re
-from textblob import TextBlob
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
+import time
+import threading
+import multiprocessing
+from collections import deque
+from functools import cached_property, lru_cache
+from itertools import islice
+from mood_lexicon import MoodLexicon
+from fast_preprocess import FastPreprocessor
 
-class TextMoodAnalyzer:
+# TextBlob, VADER and NLTK are imported on first use: together they take over a second to
+# import, and the keyword stage answers many texts without touching any of them
+
+NO_VADER_SCORES = {'compound': 0.0, 'neg': 0.0}
+
+
+class MoodPipeline:
     def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        self.lemmatizer = WordNetLemmatizer()
-        self.analyzer = SentimentIntensityAnalyzer()
-        self.mood_keywords = {
-            'happy': ['happy', 'joy', 'excited', 'cheerful', 'glad', 'elated', 'euphoric', 'delighted', 'amazing', 'wonderful', 'great', 'fantastic', 'awesome'],
-            'sad': ['sad', 'depressed', 'down', 'blue', 'melancholy', 'gloomy', 'sorrowful', 'heartbroken', 'crying', 'tears', 'lonely', 'empty'],
-            'angry': ['angry', 'mad', 'furious', 'rage', 'annoyed', 'irritated', 'frustrated', 'pissed', 'hate', 'livid', 'outraged'],
-            'fear': ['scared', 'afraid', 'terrified', 'anxious', 'worried', 'nervous', 'panic', 'frightened', 'fearful', 'apprehensive'],
-            'surprise': ['surprised', 'shocked', 'amazed', 'astonished', 'stunned', 'bewildered', 'confused', 'unexpected'],
-            'neutral': ['okay', 'fine', 'normal', 'regular', 'usual', 'typical', 'average'],
-            'energetic': ['energetic', 'active', 'pumped', 'motivated', 'driven', 'dynamic', 'vigorous', 'lively'],
-            'calm': ['calm', 'peaceful', 'relaxed', 'serene', 'tranquil', 'quiet', 'restful', 'zen', 'meditative'],
-        }
+        self.stages = []
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, stage, before=None):
+        entry = (name, stage)
+        if before is None:
+            self.stages.append(entry)
+        else:
+            names = [stage_name for stage_name, _ in self.stages]
+            self.stages.insert(names.index(before), entry)
+        self._timings.setdefault(name, {'calls': 0, 'decided': 0, 'seconds': 0.0})
+
+    def remove_stage(self, name):
+        self.stages = [(stage_name, stage) for stage_name, stage in self.stages if stage_name != name]
+
+    def run(self, text, skip_stages=()):
+        # Stages run cheapest first and share a context; the first one to return a result wins
+        context = {'text': text, 'skip_stages': skip_stages}
+        for name, stage in self.stages:
+            if name in skip_stages:
+                continue
+            started = time.perf_counter()
+            result = stage(context)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                timing = self._timings[name]
+                timing['calls'] += 1
+                timing['seconds'] += elapsed
+                if result is not None:
+                    timing['decided'] += 1
+            if result is not None:
+                return result
+        return None
+
+    def timings(self):
+        with self._lock:
+            return {
+                name: {**timing, 'avg_ms': 1000 * timing['seconds'] / timing['calls'] if timing['calls'] else 0.0}
+                for name, timing in self._timings.items()
+            }
+
+
+class TextMoodAnalyzer:
+    def __init__(self, lexicon=None, lexicon_path=None, preprocessor=None):
+        # An optional FastPreprocessor replaces NLTK tokenizing, stopwords and lemmatizing
+        self.preprocessor = preprocessor
+        self._nltk_loaded = False
+        self._nltk_lock = threading.Lock()
+        self.lexicon = lexicon or (MoodLexicon.from_file(lexicon_path) if lexicon_path else MoodLexicon())
+        self.mood_keywords = self.lexicon.keywords
+        self.pipeline = MoodPipeline()
+        self.pipeline.add_stage('keywords', self._keyword_stage)
+        self.pipeline.add_stage('vader', self._vader_stage)
+        self.pipeline.add_stage('textblob', self._textblob_stage)
+        self.pipeline.add_stage('sentiment', self._sentiment_stage)
+
+    def _load_nltk(self):
+        # NLTK's lazy corpus loaders are not safe to load for the first time from several threads
+        # at once, and sessions may call in while the background warm-up is still loading them
+        if self._nltk_loaded:
+            return
+        with self._nltk_lock:
+            if self._nltk_loaded:
+                return
+            from nltk.tokenize import word_tokenize
+            word_tokenize("warming up")
+            self.stop_words
+            self.lemmatizer.lemmatize("warming")
+            self._nltk_loaded = True
+
+    @cached_property
+    def stop_words(self):
+        from nltk.corpus import stopwords
+        return set(stopwords.words('english'))
+
+    @cached_property
+    def lemmatizer(self):
+        from nltk.stem import WordNetLemmatizer
+        return WordNetLemmatizer()
+
+    @cached_property
+    def analyzer(self):
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        return SentimentIntensityAnalyzer()
+
+    @cached_property
+    def lemmatize(self):
+        if self.preprocessor is not None:
+            return self.preprocessor.lemmatize
+        # Lexicon misses fall back to the lemma; memoized since the same words recur constantly
+        self._load_nltk()
+        return lru_cache(maxsize=50000)(self.lemmatizer.lemmatize)
 
     def preprocess_text(self, text):
+        if self.preprocessor is not None:
+            return self.preprocessor.preprocess(text)
+        self._load_nltk()
+        from nltk.tokenize import word_tokenize
         text = text.lower()
         text = re.sub(r'[^a-zA-Z\s]', '', text)
         tokens = word_tokenize(text)
@@ -32,20 +125,14 @@ class TextMoodAnalyzer:
                 processed_tokens.append(lemmatized)
         return processed_tokens
 
+    def _lemmatize_token(self, token):
+        # Defers building the lemmatizer (and importing NLTK) until a token actually misses
+        return self.lemmatize(token)
+
     def extract_mood_from_keywords(self, tokens):
-        mood_scores = {mood: 0 for mood in self.mood_keywords.keys()}
-        for token in tokens:
-            for mood, keywords in self.mood_keywords.items():
-                if token in keywords:
-                    mood_scores[mood] += 1
-        if max(mood_scores.values()) > 0:
-            return max(mood_scores, key=mood_scores.get)
-        return None
+        return self.lexicon.best_mood(tokens, self._lemmatize_token)
 
-    def analyze_sentiment(self, text):
-        vader_scores = self.analyzer.polarity_scores(text)
-        blob = TextBlob(text)
-        textblob_polarity = blob.sentiment.polarity
+    def _classify_sentiment(self, vader_scores, textblob_polarity):
         compound = vader_scores['compound']
         if compound >= 0.5 or textblob_polarity > 0.3:
             return 'happy'
@@ -60,12 +147,122 @@ class TextMoodAnalyzer:
         else:
             return 'neutral'
 
-    def predict_mood(self, user_input):
+    def analyze_sentiment(self, text, skip_stages=()):
+        if 'vader' in skip_stages:
+            vader_scores = NO_VADER_SCORES
+        else:
+            vader_scores = self.analyzer.polarity_scores(text)
+        if 'textblob' in skip_stages:
+            textblob_polarity = 0.0
+        else:
+            from textblob import TextBlob
+            blob = TextBlob(text)
+            textblob_polarity = blob.sentiment.polarity
+        return self._classify_sentiment(vader_scores, textblob_polarity)
+
+    def _keyword_stage(self, context):
+        # Raw tokens keep negators and stopword-like keywords ("down") that preprocess_text would drop
+        keyword_mood = self.extract_mood_from_keywords(self.lexicon.tokenize(context['text']))
+        return (keyword_mood, 0.8) if keyword_mood else None
+
+    def _vader_stage(self, context):
+        context['vader'] = self.analyzer.polarity_scores(context['text'])
+        # A strongly positive compound is 'happy' whatever TextBlob says, so TextBlob can be skipped
+        if context['vader']['compound'] >= 0.5:
+            return 'happy', 0.6
+        return None
+
+    def _textblob_stage(self, context):
+        from textblob import TextBlob
+        context['textblob'] = TextBlob(context['text']).sentiment.polarity
+        return None
+
+    def _sentiment_stage(self, context):
+        mood = self._classify_sentiment(context.get('vader', NO_VADER_SCORES), context.get('textblob', 0.0))
+        return mood, 0.6
+
+    def predict_mood(self, user_input, skip_stages=()):
         if not user_input.strip():
             return 'neutral', 0.5
-        tokens = self.preprocess_text(user_input)
-        keyword_mood = self.extract_mood_from_keywords(tokens)
-        sentiment_mood = self.analyze_sentiment(user_input)
-        final_mood = keyword_mood if keyword_mood else sentiment_mood
-        confidence = 0.8 if keyword_mood else 0.6
-        return final_mood, confidence
\ No newline at end of file
+        return self.pipeline.run(user_input, skip_stages) or ('neutral', 0.6)
+
+
+class BatchStats:
+    def __init__(self):
+        self.texts = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def texts_per_second(self):
+        elapsed = self.elapsed
+        return self.texts / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.texts} texts in {self.elapsed:.1f}s ({self.texts_per_second:.0f} texts/s)"
+
+
+_worker_analyzer = None
+_worker_skip_stages = ()
+
+
+def _init_worker(lexicon_path, skip_stages, lemma_table_path=None):
+    global _worker_analyzer, _worker_skip_stages
+    preprocessor = FastPreprocessor.from_file(lemma_table_path) if lemma_table_path else None
+    _worker_analyzer = TextMoodAnalyzer(lexicon_path=lexicon_path, preprocessor=preprocessor)
+    _worker_skip_stages = skip_stages
+
+
+def _analyze_chunk(texts):
+    return [_worker_analyzer.predict_mood(text, _worker_skip_stages) for text in texts]
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def predict_moods(texts, processes=None, chunk_size=256, skip_stages=(), lexicon_path=None,
+                  stats=None, report_every=None, lemma_table_path=None):
+    stats = stats if stats is not None else BatchStats()
+    skip_stages = tuple(skip_stages)
+    processes = processes or multiprocessing.cpu_count()
+    last_report = time.perf_counter()
+
+    def record(results):
+        nonlocal last_report
+        stats.texts += len(results)
+        stats.chunks += 1
+        if report_every and time.perf_counter() - last_report >= report_every:
+            print(f"predict_moods: {stats}")
+            last_report = time.perf_counter()
+
+    if processes == 1:
+        _init_worker(lexicon_path, skip_stages, lemma_table_path)
+        for chunk in _chunked(texts, chunk_size):
+            results = _analyze_chunk(chunk)
+            record(results)
+            yield from results
+        return
+
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(lexicon_path, skip_stages, lemma_table_path)) as pool:
+        # Pool.imap would drain the whole input up front; a bounded window keeps memory flat on huge archives
+        pending = deque()
+        for chunk in _chunked(texts, chunk_size):
+            pending.append(pool.apply_async(_analyze_chunk, (chunk,)))
+            if len(pending) >= processes * 2:
+                results = pending.popleft().get()
+                record(results)
+                yield from results
+        while pending:
+            results = pending.popleft().get()
+            record(results)
+            yield from results
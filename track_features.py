@@ -0,0 +1,81 @@
+import hashlib
+import json
+import numpy as np
+
+# Bump whenever the layout or hashing of track vectors changes; persisted vectors
+# built under another version must be rebuilt rather than reused.
+FEATURE_SCHEMA_VERSION = 2
+
+DEFAULT_GENRES = [
+    'pop', 'rock', 'electronic', 'indie', 'trance', 'rap', 'hip-hop', 'metal',
+    'jazz', 'ambient', 'classical', 'folk', 'reggae', 'funk', 'blues',
+    'dance', 'country', 'alternative', 'punk', 'soul', 'r&b', 'Unknown'
+]
+
+DEFAULT_MOODS = [
+    'happy', 'sad', 'angry', 'calm', 'energetic', 'neutral',
+    'surprise', 'romantic', 'melancholy', 'excited', 'peaceful'
+]
+
+
+def stable_hash(value):
+    # Unlike hash(), blake2b is not salted per process, so buckets agree across workers and restarts
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class TrackVectorizer:
+    def __init__(self, genres=None, moods=None, artist_buckets=50, signed_hashing=False):
+        self.all_genres = list(genres or DEFAULT_GENRES)
+        self.all_moods = list(moods or DEFAULT_MOODS)
+        self.artist_buckets = artist_buckets
+        self.signed_hashing = signed_hashing
+        self.artist_offset = len(self.all_genres) + len(self.all_moods)
+        self.vector_size = self.artist_offset + artist_buckets
+        self._genre_index = {}
+        for i, g in enumerate(self.all_genres):
+            self._genre_index.setdefault(g.lower(), i)
+        self._mood_index = {}
+        for i, m in enumerate(self.all_moods):
+            self._mood_index.setdefault(m.lower(), len(self.all_genres) + i)
+        self.schema = {
+            'version': FEATURE_SCHEMA_VERSION,
+            'genres': self.all_genres,
+            'moods': self.all_moods,
+            'artist_buckets': artist_buckets,
+            'signed_hashing': signed_hashing,
+            'hash': 'blake2b-64'
+        }
+        self.schema_id = hashlib.blake2b(
+            json.dumps(self.schema, sort_keys=True).encode('utf-8'), digest_size=6
+        ).hexdigest()
+
+    def artist_feature(self, artist):
+        h = stable_hash(artist.lower())
+        column = self.artist_offset + h % self.artist_buckets
+        sign = 1.0
+        # The top bit is independent of the bucket, so colliding artists cancel out on average
+        if self.signed_hashing and (h >> 63) & 1:
+            sign = -1.0
+        return column, sign
+
+    def vectorize_tracks(self, tracks):
+        matrix = np.zeros((len(tracks), self.vector_size), dtype=np.float32)
+        for row, track in enumerate(tracks):
+            try:
+                genre_col = self._genre_index.get(track.get('genre', 'Unknown').lower())
+                mood_col = self._mood_index.get(track.get('mood', 'neutral').lower())
+                artist_col, artist_sign = self.artist_feature(track.get('artist', 'Unknown'))
+            except Exception as e:
+                # A malformed track becomes an all-zero vector and never matches anything
+                print(f"Error vectorizing track: {e}")
+                continue
+            if genre_col is not None:
+                matrix[row, genre_col] = 1
+            if mood_col is not None:
+                matrix[row, mood_col] = 1
+            matrix[row, artist_col] = artist_sign
+        return matrix
+
+    def vectorize_track(self, track):
+        return self.vectorize_tracks([track])[0]
@@ -18,14 +18,17 @@ class UserAuth:
         return self.db.authenticate_user(email, password)
 
     def get_user_profile(self, user_id):
-        user = self.db.get_user_by_id(user_id)
+        user = self.db.get_user_profile(user_id)
         if not user:
             return None
+        return self.build_profile(user)
+
+    def build_profile(self, user):
         return {
             'id': str(user['_id']),
             'username': user['username'],
             'email': user['email'],
             'created_at': user.get('createdAt'),
             'last_login': user.get('lastLogin'),
-            'liked_tracks_count': len(user.get('likedTracks', []))
+            'liked_tracks_count': self.db.count_liked_tracks(user['_id'])
         }
\ No newline at end of file